@@ -19,7 +19,8 @@ from langgraph.graph import StateGraph, START, END
 try:
     from generalist.agents.core import AgentPlan, AgentDeepWebSearch, AgentUnstructuredDataProcessor, AgentCodeWriterExecutor
     from generalist.tools.data_model import ShortAnswer, Message
-    from generalist.tools.planning import determine_next_step, parse_out_resource_link
+    from generalist.tools.planning import determine_next_step
+    from generalist.tools.text_processing.utils import parse_out_resource_link
     from generalist.agents.workflows.tasks.reflection_evaluation import construct_short_answer, summarise_findings
     from browser import BRAVE_SEARCH_SESSION
 except ImportError as e:
@@ -85,17 +86,14 @@ def init_state(ask: str, resources: Optional[List[Message]] = None) -> Execution
 
 def set_task(state: ExecutionState) -> ExecutionState:
     """Parse the user's ask and create a task message."""
-    # Parse out any links from the user's message
-    parsed_out_resource = parse_out_resource_link(state["ask"])
-
-    # Create the new message
+    # Create the new message, linking the resource mentioned in the user's message (if not attached already)
+    known_links = [state["resource"].link] if state.get("resource") else []
     task_msg = Message(
         provided_by="user",
         content=state["ask"],
+        link=parse_out_resource_link(state["ask"], known_links),
         metadata={},
     )
-    if parsed_out_resource:
-        task_msg.link = parsed_out_resource["link"]
 
     state["task"] = task_msg
     state["step"] = 0
@@ -1,4 +1,4 @@
-import json
+import orjson
 from typing import Any, AsyncGenerator
 import time
 from fastapi.responses import StreamingResponse
@@ -25,7 +25,7 @@ def _chat_completions_sse_chunk(content: str, created: int) -> str:
             }
         ],
     }
-    return f"data: {json.dumps(data)}\n\n"
+    return f"data: {orjson.dumps(data).decode()}\n\n"
 
 def _chat_completions_sse_done(created: int) -> str:
     data = {
@@ -35,7 +35,7 @@ def _chat_completions_sse_done(created: int) -> str:
         'model': MODEL_NAME_BROWSER,
         'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
     }
-    return f"data: {json.dumps(data)}\n\ndata: [DONE]\n\n"
+    return f"data: {orjson.dumps(data).decode()}\n\ndata: [DONE]\n\n"
 
 async def _chat_completions_stream_answer(answer: str) -> AsyncGenerator[str, None]:
     created = int(time.time())
@@ -47,7 +47,7 @@ async def _chat_completions_stream_answer(answer: str) -> AsyncGenerator[str, No
 async def handle_chat_completions(req: dict[str, Any], llm: LLMBrowserServer):
     answer, tool = llm.complete_with_tools(str(req["body"]["messages"]))
 
-    logger.info(f"[LLM] Output:\n{answer}\nTool:\n{tool}")
+    logger.info("[LLM] Output (%d chars):\n%.500s\nTool:\n%s", len(answer), answer, tool)
 
     if tool:
         raise NotImplementedError("Calling ClosedAI API with tools is not implemented.")
@@ -92,7 +92,7 @@ def _api_chat_sse_chunk(content: str, created: int) -> str:
         },
         "done": False,
     }
-    return json.dumps(data) + "\n"
+    return orjson.dumps(data).decode() + "\n"
 
 def _api_chat_tool(created: int, tool: dict) -> str:
     data = {
@@ -106,7 +106,7 @@ def _api_chat_tool(created: int, tool: dict) -> str:
         "done": False,
     }
 
-    return json.dumps(data) + "\n"
+    return orjson.dumps(data).decode() + "\n"
 
 def _api_chat_sse_done(created: int) -> str:
     data = {
@@ -119,7 +119,7 @@ def _api_chat_sse_done(created: int) -> str:
         "done": True,
         "done_reason": "stop",
     }
-    return json.dumps(data) + "\n"
+    return orjson.dumps(data).decode() + "\n"
 
 async def _api_chat_stream_answer(answer: str, tool: dict) -> AsyncGenerator[str, None]:
     created = int(time.time())
@@ -135,7 +135,7 @@ async def _api_chat_stream_answer(answer: str, tool: dict) -> AsyncGenerator[str
 async def handle_api_chat(req: dict, llm: LLMBrowserServer):
     answer, tool = llm.complete_with_tools(str(req["body"]["messages"]))
 
-    logger.info(f"[LLM] Output:\n{answer}\nTool:\n{tool}")
+    logger.info("[LLM] Output (%d chars):\n%.500s\nTool:\n%s", len(answer), answer, tool)
 
     # SSE = server side streaming
     if req["body"].get('stream'):
@@ -144,7 +144,7 @@ async def handle_api_chat(req: dict, llm: LLMBrowserServer):
             media_type='text/event-stream',
         )
 
-    return json.dumps({
+    return orjson.dumps({
         'created_at': int(time.time()),
         'model': MODEL_NAME_BROWSER,
         'message': {
@@ -154,7 +154,7 @@ async def handle_api_chat(req: dict, llm: LLMBrowserServer):
         "done": True,
         "done_reason": "stop",
         }
-    )
+    ).decode()
 
 async def handle_models_list() -> dict[str, Any]:
     raise NotImplementedError("Implement handle_models_list in handlers.py")
@@ -1,4 +1,4 @@
-import json
+import orjson
 from contextlib import asynccontextmanager
 from typing import Annotated
 
@@ -60,7 +60,7 @@ def _build_full_request(request: Request, body: dict) -> dict:
 
 @app.post("/v1/chat/completions")
 async def chat_completions(request: Request, llm: LLMDep):
-    body = await request.json()
+    body = orjson.loads(await request.body())
 
     full_request = _build_full_request(request, body)
     return await handle_chat_completions(full_request, llm)
@@ -68,7 +68,7 @@ async def chat_completions(request: Request, llm: LLMDep):
 
 @app.post("/api/chat")
 async def api_chat(request: Request,  llm: LLMDep):
-    body = await request.json()
+    body = orjson.loads(await request.body())
 
     full_request = _build_full_request(request, body)
 
@@ -107,7 +107,7 @@ async def models_list():
 
 @app.post("/v1/embeddings")
 async def embeddings(request: Request):
-    body = await request.json()
+    body = orjson.loads(await request.body())
     return await handle_embeddings(body)
 
 
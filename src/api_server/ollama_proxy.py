@@ -1,6 +1,5 @@
-import json
-
 import httpx
+import orjson
 from fastapi import FastAPI, Request, Response
 from fastapi.responses import StreamingResponse
 import uvicorn
@@ -23,8 +22,8 @@ async def proxy(path: str, request: Request):
 
     # DEBUG
     try:
-        parsed = json.loads(body)
-        print("[REQUEST]\n", json.dumps(parsed, indent=2, ensure_ascii=False))
+        parsed = orjson.loads(body)
+        print("[REQUEST]\n", orjson.dumps(parsed, option=orjson.OPT_INDENT_2).decode())
     except Exception:
         print("[REQUEST]\n", body)
 
@@ -42,8 +41,8 @@ async def proxy(path: str, request: Request):
 
     # DEBUG
     try:
-        parsed = json.loads(content)
-        print("[RESPONSE]\n", json.loads(parsed, indent=2, ensure_ascii=False))
+        parsed = orjson.loads(content)
+        print("[RESPONSE]\n", orjson.dumps(parsed, option=orjson.OPT_INDENT_2).decode())
     except Exception:
         print("[RESPONSE]\n", str(content))
 
@@ -3,7 +3,7 @@ from dataclasses import dataclass
 
 from browser.search.web import BraveBrowser
 from .workflows.workflow_base import AgentWorkflow
-from ..dialer.core import MLFlowLLMWrapper
+from ..dialer.core import MLFlowLLMWrapper, planner_llm_from_env
 from ..tools import BaseTool
 from ..tools.code import TableEdaTool, WriteCodeTool, ExecuteCodeTool
 from ..tools.file_handling import ReadFileTool, ListFilesTool, FindFileTool, GrepFilesTool, \
@@ -57,10 +57,12 @@ class AgentDeepWebSearch(BaseAgent):
         activity: str,
         brave_search_session: BraveBrowser,
         llm: MLFlowLLMWrapper,
-        tools: list[BaseTool]|None = None
+        tools: list[BaseTool]|None = None,
+        planner_llm: MLFlowLLMWrapper | None = None,
     ):
         super().__init__(activity=activity)
         self.llm = llm
+        self.planner_llm = planner_llm or planner_llm_from_env()
         self.tools: list[BaseTool] = tools or [WebSearchTool(brave_search_session, llm), ReadFileTool()]
 
     def run(self) -> Message:
@@ -70,11 +72,12 @@ class AgentDeepWebSearch(BaseAgent):
             llm=self.llm,
             context=[],
             task=self.activity,
-            tools=self.tools
+            tools=self.tools,
+            planner_llm=self.planner_llm,
         )
 
         self.agent_state = agent_workflow.run()
-        logger.info(f" After running {self.name}, the final state's context is:\n{self.agent_state["context"]}")
+        logger.info(" After running %s, the final state's context is:\n%.500s", self.name, self.agent_state["context"])
 
         # last output will be a content resource with the downloaded search results (e.g., one or multiple web pages)
         last_resource = self.agent_state["context"][-1]
@@ -92,9 +95,16 @@ class AgentCodeWriterExecutor(BaseAgent):
     capability = "can write programming code, also execute only python code"
     agent_state = None
 
-    def __init__(self, activity: str, llm: MLFlowLLMWrapper, tools: list[BaseTool]|None = None):
+    def __init__(
+        self,
+        activity: str,
+        llm: MLFlowLLMWrapper,
+        tools: list[BaseTool]|None = None,
+        planner_llm: MLFlowLLMWrapper | None = None,
+    ):
         super().__init__(activity=activity)
         self.llm = llm
+        self.planner_llm = planner_llm or planner_llm_from_env()
         self.tools: list[BaseTool] = tools or [
             TableEdaTool(), WriteCodeTool(llm), ExecuteCodeTool(),
             ReadFileTool(), FindFileTool(), ListFilesTool(), GrepFilesTool(), CreateReplaceFileContentsTool(),
@@ -108,10 +118,11 @@ class AgentCodeWriterExecutor(BaseAgent):
             llm=self.llm,
             context=resources,
             task=self.activity,
-            tools=self.tools
+            tools=self.tools,
+            planner_llm=self.planner_llm,
         )
         self.agent_state = agent_workflow.run()
-        logger.info(f" After running the agent workflow :\n{self.agent_state}")
+        logger.info(" After running the agent workflow :\n%.500s", self.agent_state)
 
         return Message(
             provided_by=self.name,
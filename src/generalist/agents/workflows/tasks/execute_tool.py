@@ -1,11 +1,26 @@
+from functools import lru_cache
+
 from generalist.dialer.core import MLFlowLLMWrapper, LLMResponse
-from generalist.prompt_modifiers.ollama_tool_call import tool_to_llm_schema, add_tool_directive
+from generalist.prompt_modifiers.ollama_tool_call import tool_to_llm_schema
 from generalist.tools import BaseTool
+from generalist.agents.workflows.tasks.plan_action import tools_description
+from generalist.agents.workflows.tasks.prompts import CALL_TOOL_SYSTEM_PROMPT, CALL_TOOL_PROMPT, \
+    CALL_TOOL_NATIVE_SYSTEM_PROMPT, CALL_TOOL_NATIVE_PROMPT, PLAN_AND_CALL_TOOL_SYSTEM_PROMPT, \
+    PLAN_AND_CALL_TOOL_NATIVE_SYSTEM_PROMPT, PLAN_AND_CALL_TOOL_PROMPT
 from clog import get_logger
 
 
 logger = get_logger(__name__)
 
+# Greedy decoding: the tool call should follow the plan, not be sampled
+CALL_TOOL_OPTIONS = {"temperature": 0}
+
+
+@lru_cache(maxsize=64)
+def _tools_schema(tool_types: tuple[type[BaseTool], ...]) -> str:
+    """The schema only depends on the tool classes (name and `run` signature), so build it once per tool set."""
+    return str([tool_to_llm_schema(tool_type) for tool_type in tool_types])
+
 
 def call_tool(
     task: str,
@@ -17,33 +32,51 @@ def call_tool(
     # TODO: so the dilemma here is whether to add context like so
     #  Context from previous steps:
     #  {context} or leave this prompt without context
-    prompt = f"""
-    Task: {task}
-
-    Plan: {plan}
+    if llm.native_tool_calls:
+        # the tool schemas are handed to the backend's tool calling, no need to repeat them (and the format) here
+        prompt = CALL_TOOL_NATIVE_PROMPT.format(task=task, plan=plan)
+        system = CALL_TOOL_NATIVE_SYSTEM_PROMPT
+    else:
+        prompt = CALL_TOOL_PROMPT.format(
+            tools=_tools_schema(tuple(type(tool) for tool in tools)) if tools else None,
+            task=task,
+            plan=plan,
+        )
+        system = CALL_TOOL_SYSTEM_PROMPT
 
-    **IMPORTANT: Your ONLY output must be a single JSON tool call — no explanation, no prose, nothing else.**
+    response = llm.predict_and_call(prompt=prompt, tools=tools, system=system, options=CALL_TOOL_OPTIONS)
+    logger.info("Tool called: %s", response.tool_call.tool_name if response.tool_call else "none")
 
-    Available tools:
-        {[tool_to_llm_schema(tool) for tool in tools] if tools else None}
+    return response
 
-    Required output format:
-    ```json
-    {{
-        "function": {{
-            "name": "<tool_name>",
-            "arguments": {{
-                "<param>": "<value>"
-            }}
-        }}
-    }}
-    ```
 
-    Pick exactly ONE tool from the list above that best advances the plan. Output only the JSON (with ```json ``` formatting).
+def plan_and_call_tool(
+    task: str,
+    context: str,
+    agent_capability: str,
+    tools: list[BaseTool],
+    llm: MLFlowLLMWrapper,
+) -> LLMResponse:
+    """
+    Plans the first action and calls the tool in a single llm call, instead of `plan_next_action` + `call_tool`.
+    The plan is the text of the response.
     """
-    prompt_formatted = add_tool_directive(prompt)
+    tool_types = tuple(type(tool) for tool in tools)
+    if llm.native_tool_calls:
+        # the backend gets the schemas, the names and descriptions are enough in the prompt
+        tools_str = tools_description(tool_types)
+        system = PLAN_AND_CALL_TOOL_NATIVE_SYSTEM_PROMPT
+    else:
+        tools_str = _tools_schema(tool_types)
+        system = PLAN_AND_CALL_TOOL_SYSTEM_PROMPT
+    prompt = PLAN_AND_CALL_TOOL_PROMPT.format(
+        agent_capability=agent_capability,
+        tools=tools_str,
+        task=task,
+        context=context,
+    )
 
-    response = llm.predict_and_call(prompt=prompt_formatted, tools=tools)
-    logger.info(f"Tool called: {response.tool_call.tool_name if response.tool_call else 'none'}")
+    response = llm.predict_and_call(prompt=prompt, tools=tools, system=system, options=CALL_TOOL_OPTIONS)
+    logger.info("Planned and called tool: %s", response.tool_call.tool_name if response.tool_call else "none")
 
     return response
@@ -1,10 +1,36 @@
+import os
+from functools import lru_cache
+from pathlib import Path
+
 from generalist.dialer.core import MLFlowLLMWrapper
+from generalist.dialer.cache import KeywordCache, semantic_cache_from_env, sha256_key, CACHE_HIT_EXACT, \
+    CACHE_HIT_SEMANTIC
 from generalist.tools import BaseTool
+from generalist.agents.workflows.tasks.prompts import PLAN_ACTION_SYSTEM_PROMPT, PLAN_ACTION_PROMPT, ADAPT_PLAN_PROMPT, \
+    ADAPT_PLAN_TEMPLATE_PROMPT
 from clog import get_logger
 
 
 logger = get_logger(__name__)
 
+# Greedy decoding (also makes plans cacheable), a plan is 2-3 sentences: cap the decoded tokens
+PLAN_ACTION_OPTIONS = {"temperature": 0, "num_predict": 256}
+
+# Plans are reused for (near) identical tasks given the same context, e.g. when re-running an agent
+PLAN_CACHE = semantic_cache_from_env("plan", threshold=0.9)
+# First plans of earlier runs are adapted for tasks with (mostly) the same keywords, for the same agent and tools
+PLAN_TEMPLATES_PATH = Path(os.environ.get("PLAN_TEMPLATES_PATH", Path.home() / ".cache" / "generalist" / "plans.jsonl"))
+PLAN_TEMPLATES = (
+    KeywordCache(PLAN_TEMPLATES_PATH, threshold=0.6, max_entries=int(os.environ.get("PLAN_TEMPLATES_MAX_ENTRIES", 1000)))
+    if os.environ.get("PLAN_TEMPLATES_ENABLED") else None
+)
+
+
+@lru_cache(maxsize=64)
+def tools_description(tool_types: tuple[type[BaseTool], ...]) -> str:
+    """Names and descriptions are class attributes, so build the list once per tool set."""
+    return "\n".join([f"- {tool_type.name}: {tool_type.description}" for tool_type in tool_types])
+
 
 def plan_next_action(
     task: str,
@@ -14,29 +40,43 @@ def plan_next_action(
     previous_reflection: str | None,
     llm: MLFlowLLMWrapper,
 ) -> str:
-    tools_str = "\n".join([f"- {tool.name}: {tool.description}" for tool in tools])
-
-    prompt = f"""
-    Role: {agent_capability}
+    tools_str = tools_description(tuple(type(tool) for tool in tools))
 
-    Task: {task}
+    cache_scope = sha256_key(llm.model, agent_capability, tools_str, context, previous_reflection or "")
+    if PLAN_CACHE:
+        hit, cached_plan = PLAN_CACHE.get(task, scope=cache_scope)
+        logger.info("plan_cache hit=%s", hit)
+        if hit == CACHE_HIT_EXACT:
+            return cached_plan
+        if hit == CACHE_HIT_SEMANTIC:
+            prompt = ADAPT_PLAN_PROMPT.format(cached_plan=cached_plan, task=task)
+            plan = llm.complete(prompt, system=PLAN_ACTION_SYSTEM_PROMPT, options=PLAN_ACTION_OPTIONS).text.strip()
+            PLAN_CACHE.set(task, plan, scope=cache_scope)
+            return plan
 
-    Context from previous steps:
-    {context}
+    # Note: templates are only used for the first step, later plans depend on the reflection on the progress
+    template_scope = sha256_key(agent_capability, tools_str)
+    if PLAN_TEMPLATES and not previous_reflection:
+        template_plan = PLAN_TEMPLATES.get(task, scope=template_scope)
+        logger.info("plan_templates hit=%s", template_plan is not None)
+        if template_plan is not None:
+            prompt = ADAPT_PLAN_TEMPLATE_PROMPT.format(template_plan=template_plan, task=task, context=context)
+            return llm.complete(prompt, system=PLAN_ACTION_SYSTEM_PROMPT, options=PLAN_ACTION_OPTIONS).text.strip()
 
-    {f"Previous reflection: {previous_reflection}" if previous_reflection else ""}
+    prompt = PLAN_ACTION_PROMPT.format(
+        agent_capability=agent_capability,
+        tools=tools_str,
+        task=task,
+        context=context,
+        previous_reflection=f"Previous reflection: {previous_reflection}" if previous_reflection else "",
+    )
 
-    Available tools:
-    {tools_str}
-    
-    **IMPORTANT**
-    Based on the task and available context, produce a plan only — DO NOT EXECUTE ANYTHING!
-    Identify which tool to use next and why, given what is already known.
-    The plan MUST BE SELF-CONTAINED: include all key details (e.g. file paths, parameters, values from context) needed to execute the next step without referring back to prior context.
-    Be concise (2-3 sentences).
-    """
-
-    response = llm.complete(prompt)
+    response = llm.complete(prompt, system=PLAN_ACTION_SYSTEM_PROMPT, options=PLAN_ACTION_OPTIONS)
     plan = response.text.strip()
 
+    if PLAN_CACHE:
+        PLAN_CACHE.set(task, plan, scope=cache_scope)
+    if PLAN_TEMPLATES and not previous_reflection:
+        PLAN_TEMPLATES.set(task, plan, scope=template_scope)
+
     return plan
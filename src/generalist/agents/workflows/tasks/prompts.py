@@ -0,0 +1,174 @@
+"""
+Prompt templates of the agent workflow tasks, filled in with `str.format`.
+
+Keep them in one place so that every call sends the same (byte-identical) static parts.
+Static instructions go into the system prompts, so that the prefix is byte-identical across calls.
+The context comes after the parts that are fixed for an agent (role, tools, task): it only grows between steps,
+so the prompts of consecutive steps share a prefix.
+"""
+from generalist.prompt_modifiers.ollama_tool_call import add_tool_directive
+
+
+PLAN_ACTION_SYSTEM_PROMPT = """
+**IMPORTANT**
+Based on the task and available context, produce a plan only — DO NOT EXECUTE ANYTHING!
+Identify which tool to use next and why, given what is already known.
+The plan MUST BE SELF-CONTAINED: include all key details (e.g. file paths, parameters, values from context) needed to execute the next step without referring back to prior context.
+Be concise (2-3 sentences).
+"""
+
+PLAN_ACTION_PROMPT = """
+    Role: {agent_capability}
+
+    Available tools:
+    {tools}
+
+    Task: {task}
+
+    Context from previous steps:
+    {context}
+
+    {previous_reflection}
+    """
+
+ADAPT_PLAN_PROMPT = """
+    A plan was already made for a very similar task with the same context and tools:
+    {cached_plan}
+
+    Adapt this plan to the task below, keep all key details (e.g. file paths, parameters, values).
+
+    Task: {task}
+    """
+
+ADAPT_PLAN_TEMPLATE_PROMPT = """
+    A plan was made for a similar task before:
+    {template_plan}
+
+    Adapt this plan to the task below: replace all details (e.g. file paths, parameters, values) with the ones of this task and its context.
+
+    Task: {task}
+
+    Context from previous steps:
+    {context}
+    """
+
+
+CALL_TOOL_NATIVE_SYSTEM_PROMPT = """
+    **IMPORTANT: Your ONLY output must be a single JSON tool call — no explanation, no prose, nothing else.**
+    Pick exactly ONE tool from the available tools that best advances the plan.
+    """
+
+# For backends without native tool calling (the tool call is parsed out of the answer)
+# Note: the output format and an example are appended by `add_tool_directive`, do not repeat them here
+CALL_TOOL_SYSTEM_PROMPT = add_tool_directive(CALL_TOOL_NATIVE_SYSTEM_PROMPT)
+
+CALL_TOOL_NATIVE_PROMPT = """
+    Task: {task}
+
+    Plan: {plan}
+    """
+
+CALL_TOOL_PROMPT = """
+    Available tools:
+        {tools}
+
+    Task: {task}
+
+    Plan: {plan}
+    """
+
+
+# First step of an agent: plan and call the tool in one go
+PLAN_AND_CALL_TOOL_NATIVE_SYSTEM_PROMPT = """
+    **IMPORTANT**
+    First write the plan: which tool to use and why, including all key details (e.g. file paths, parameters) in 1-2 sentences.
+    Then call exactly ONE tool from the available tools that carries out the plan.
+    """
+
+# Note: the output format and an example are appended by `add_tool_directive`, do not repeat them here
+PLAN_AND_CALL_TOOL_SYSTEM_PROMPT = add_tool_directive(PLAN_AND_CALL_TOOL_NATIVE_SYSTEM_PROMPT)
+
+PLAN_AND_CALL_TOOL_PROMPT = """
+    Role: {agent_capability}
+
+    Available tools:
+        {tools}
+
+    Task: {task}
+
+    Context:
+    {context}
+    """
+
+
+REFLECTION_SYSTEM_PROMPT = """
+Reflect on the progress:
+1. What did you just learn from the latest tool output?
+2. How does this help with the task?
+3. Is the task complete, or what should you do next?
+
+Provide a brief reflection (2-3 sentences).
+"""
+
+REFLECTION_PROMPT = """
+    Role: {agent_capability}
+
+    Task: {task}
+
+    Context so far:
+    {context}
+    """
+
+
+# For backends with structured outputs: the answer is constrained to the JSON schema, only the fields are explained
+TASK_COMPLETION_STRUCTURED_SYSTEM_PROMPT = """
+Based **ONLY** on the information about the previous steps and without any additional assumptions, determine whether the agent has accomplished its task.
+And whether it should proceed to the next step.
+
+"done": whether the agent has done everything it could based on its capabilities.
+"summary": a short phrase describing what was achieved and how the task was answered, and if agent can do something else with its available capabilities.
+"""
+
+TASK_COMPLETION_SYSTEM_PROMPT = """
+Based **ONLY** on the information about the previous steps and without any additional assumptions, determine whether the agent has accomplished its task.
+And whether it should proceed to the next step.
+
+Your response MUST be valid JSON in the following format:
+```json
+{
+    "done": <true or false: whether the agent has done everything it could based on its capabilities>,
+    "summary": "<a short phrase describing what was achieved and how the task was answered, and if agent can do something else with its available capabilities.>"
+}
+```
+"""
+
+TASK_COMPLETION_PROMPT = """
+    You are an agent that can ONLY {agent_capability}. Thus your capabilities are: {agent_capability}.
+
+    Task: {task}
+
+    You are presented with a list of information describing work, actions, or outcomes of the previous steps:
+    {context}
+    """
+
+
+# Reflection and task completion in one answer (same task and context)
+REFLECT_AND_EVALUATE_STRUCTURED_SYSTEM_PROMPT = """
+Based **ONLY** on the information about the previous steps and without any additional assumptions:
+reflect on the progress and determine whether the agent has accomplished its task.
+
+"reflection": what did you just learn from the latest tool output, how does this help with the task and what should be done next (2-3 sentences).
+"done": whether the agent has done everything it could based on its capabilities.
+"summary": a short phrase describing what was achieved and how the task was answered, and if agent can do something else with its available capabilities.
+"""
+
+REFLECT_AND_EVALUATE_SYSTEM_PROMPT = REFLECT_AND_EVALUATE_STRUCTURED_SYSTEM_PROMPT + """
+Your response MUST be valid JSON in the following format:
+```json
+{
+    "reflection": "<2-3 sentences>",
+    "done": <true or false>,
+    "summary": "<a short phrase>"
+}
+```
+"""
@@ -1,9 +1,23 @@
 from generalist.dialer.core import MLFlowLLMWrapper
+from generalist.dialer.cache import RESPONSE_CACHE, semantic_cache_from_env, sha256_key
+from generalist.agents.workflows.tasks.prompts import REFLECTION_SYSTEM_PROMPT, REFLECTION_PROMPT
+from generalist.utils import run_coroutine, clip_tokens
 from clog import get_logger
 
 
 logger = get_logger(__name__)
 
+# Greedy decoding (the reflection is cached), a reflection is 2-3 sentences: cap the decoded tokens
+REFLECTION_OPTIONS = {"temperature": 0, "num_predict": 256}
+
+# Reflections are reused for an equivalent task with the same context of the same agent (revisited states of the loop)
+# Note: the context has to match exactly (scope), otherwise a step would get the reflection on the previous tool output
+REFLECTION_CACHE = semantic_cache_from_env("reflection", threshold=0.95)
+
+
+def _reflection_prompt(task: str, context: str, agent_capability: str) -> str:
+    return REFLECTION_PROMPT.format(task=task, context=context, agent_capability=agent_capability)
+
 
 def reflect_on_progress(
     task: str,
@@ -11,23 +25,31 @@ def reflect_on_progress(
     agent_capability: str,
     llm: MLFlowLLMWrapper,
 ) -> str:
-    prompt = f"""
-    Role: {agent_capability}
-
-    Task: {task}
-
-    Context so far:
-    {context}
+    return run_coroutine(areflect_on_progress(task, context, agent_capability, llm))
 
-    Reflect on the progress:
-    1. What did you just learn from the latest tool output?
-    2. How does this help with the task?
-    3. Is the task complete, or what should you do next?
 
-    Provide a brief reflection (2-3 sentences).
-    """
-
-    response = llm.complete(prompt)
+async def areflect_on_progress(
+    task: str,
+    context: str,
+    agent_capability: str,
+    llm: MLFlowLLMWrapper,
+) -> str:
+    """Async `reflect_on_progress`, to be awaited together with other llm calls."""
+    context = clip_tokens(context)
+    cache_key = sha256_key("reflect_on_progress", llm.model, task, context, agent_capability)
+    cached_reflection = RESPONSE_CACHE.get(cache_key)
+    if cached_reflection is None and REFLECTION_CACHE:
+        hit, cached_reflection = REFLECTION_CACHE.get(task, scope=sha256_key(llm.model, agent_capability, context))
+        logger.info("reflection_cache hit=%s", hit)
+    if cached_reflection is not None:
+        return cached_reflection
+
+    response = await llm.acomplete(
+        _reflection_prompt(task, context, agent_capability), system=REFLECTION_SYSTEM_PROMPT, options=REFLECTION_OPTIONS
+    )
     reflection = response.text.strip()
+    RESPONSE_CACHE.set(cache_key, reflection)
+    if REFLECTION_CACHE:
+        REFLECTION_CACHE.set(task, reflection, scope=sha256_key(llm.model, agent_capability, context))
 
     return reflection
@@ -1,13 +1,118 @@
-import json
-import regex as re
+import asyncio
+import os
 
 from generalist.tools.data_model import AgentRunSummary
 from generalist.dialer.core import MLFlowLLMWrapper
+from generalist.prompt_modifiers.utils import strip_json_fence, loads_json
+from generalist.dialer.cache import RESPONSE_CACHE, semantic_cache_from_env, sha256_key
+from generalist.agents.workflows.tasks.prompts import TASK_COMPLETION_SYSTEM_PROMPT, TASK_COMPLETION_PROMPT, \
+    TASK_COMPLETION_STRUCTURED_SYSTEM_PROMPT, REFLECT_AND_EVALUATE_SYSTEM_PROMPT, \
+    REFLECT_AND_EVALUATE_STRUCTURED_SYSTEM_PROMPT
+from generalist.agents.workflows.tasks.reflect import areflect_on_progress
+from generalist.utils import run_coroutine, clip_tokens
 from clog import get_logger
 
 
 logger = get_logger(__name__)
 
+# JSON schema of the answer: backends with structured outputs (ollama's `format`) constrain decoding to it
+TASK_COMPLETION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "done": {"type": "boolean"},
+        "summary": {"type": "string"},
+    },
+    "required": ["done", "summary"],
+}
+# Greedy decoding (the verdict is cached), the answer is a short JSON object: cap the decoded tokens
+TASK_COMPLETION_OPTIONS = {"temperature": 0, "num_predict": 512}
+# Reflection and verdict in one answer, see `areflect_and_evaluate`
+REFLECT_AND_EVALUATE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "reflection": {"type": "string"},
+        "done": {"type": "boolean"},
+        "summary": {"type": "string"},
+    },
+    "required": ["reflection", "done", "summary"],
+}
+REFLECT_AND_EVALUATE_OPTIONS = {"temperature": 0, "num_predict": 768}
+# An unparsable answer is resampled a few times concurrently (slightly randomised), the first that parses is used
+RESAMPLE_COUNT = 3
+RESAMPLE_OPTIONS = {**TASK_COMPLETION_OPTIONS, "temperature": 0.4}
+# orjson.JSONDecodeError is a ValueError, missing/mistyped fields raise the others
+PARSE_ERRORS = (ValueError, KeyError, TypeError, AttributeError)
+# "done" values that mean the task is completed (schema-constrained answers give a JSON boolean)
+_TRUE_VALUES = frozenset({"true", "yes", "1"})
+# Without any step in the context there is nothing to evaluate: the task is not completed, skip the llm call
+SKIP_EMPTY_CONTEXT = os.environ.get("COMPLETION_SKIP_EMPTY_CONTEXT", "1") == "1"
+# Empty context: no text or an empty list of messages
+_EMPTY_CONTEXTS = frozenset({"", "[]", "None"})
+
+# Verdicts are reused for an equivalent task with the same context of the same agent, e.g. when re-running an agent
+# Note: the context has to match exactly (scope), consecutive steps differ by a single message but not in verdict
+COMPLETION_CACHE = semantic_cache_from_env("completion", threshold=0.92)
+
+
+def task_completion_system_prompt(llm: MLFlowLLMWrapper) -> str:
+    return TASK_COMPLETION_STRUCTURED_SYSTEM_PROMPT if llm.structured_outputs else TASK_COMPLETION_SYSTEM_PROMPT
+
+
+def _task_completion_prompt(task: str, context: str, agent_capability: str) -> str:
+    return TASK_COMPLETION_PROMPT.format(task=task, context=context, agent_capability=agent_capability)
+
+
+def _is_true(value) -> bool:
+    """JSON booleans as they are, otherwise the string values in `_TRUE_VALUES`."""
+    return value if isinstance(value, bool) else str(value).strip().lower() in _TRUE_VALUES
+
+
+def _parse_task_completion(response_text: str, structured: bool = False) -> AgentRunSummary:
+    """`structured`: the answer was constrained to the JSON schema, there is no fence to strip."""
+    response_text = response_text.strip() if structured else strip_json_fence(response_text)
+
+    logger.info("Task completion (%d chars):\n%.500s", len(response_text), response_text)
+
+    data = loads_json(response_text)
+
+    return AgentRunSummary(
+        completed=_is_true(data["done"]),
+        # FIXME: summary is not being used anywhere, at least log it? 
+        summary=data.get("summary", "did-not-parse"),
+    )
+
+
+def _get_cached_task_completion(task: str, context: str, agent_capability: str, model: str) -> AgentRunSummary | None:
+    cached_summary = RESPONSE_CACHE.get(sha256_key("evaluate_task_completion", model, task, context, agent_capability))
+    if cached_summary is None and COMPLETION_CACHE:
+        hit, cached_summary = COMPLETION_CACHE.get(task, scope=sha256_key(model, agent_capability, context))
+        logger.info("completion_cache hit=%s", hit)
+
+    return cached_summary
+
+
+def _cache_task_completion(task: str, context: str, agent_capability: str, model: str, run_summary: AgentRunSummary):
+    RESPONSE_CACHE.set(sha256_key("evaluate_task_completion", model, task, context, agent_capability), run_summary)
+    if COMPLETION_CACHE:
+        COMPLETION_CACHE.set(task, run_summary, scope=sha256_key(model, agent_capability, context))
+
+
+async def _aresample_task_completion(prompt: str, llm: MLFlowLLMWrapper) -> AgentRunSummary:
+    """Concurrent samples cost about one round trip when the backend batches requests."""
+    responses = await asyncio.gather(*[
+        llm.acomplete_json(
+            prompt, system=task_completion_system_prompt(llm), format=TASK_COMPLETION_SCHEMA, options=RESAMPLE_OPTIONS
+        )
+        for _ in range(RESAMPLE_COUNT)
+    ])
+    for response in responses:
+        try:
+            return _parse_task_completion(response.text, structured=llm.structured_outputs)
+        except PARSE_ERRORS as e:
+            logger.warning("Resampled task completion is not parsable either: %s", e)
+
+    raise ValueError(f"None of the {RESAMPLE_COUNT} resampled task completions could be parsed")
+
 
 def evaluate_task_completion(task: str, context: str, agent_capability: str, llm: MLFlowLLMWrapper) -> AgentRunSummary:
     """
@@ -17,47 +122,81 @@ def evaluate_task_completion(task: str, context: str, agent_capability: str, llm
     if the main steps or intent appear to be fulfilled based solely on
     the given resources.
     """
+    return run_coroutine(aevaluate_task_completion(task, context, agent_capability, llm))
 
-    prompt = f"""
-    You are an agent that can ONLY {agent_capability}. Thus your capabilities are: {agent_capability}. 
-    You are presented with a list of information describing work, actions, or outcomes of the previous steps:
-    {context}
-
-    Based **ONLY** on the resources above and without any additional assumptions, determine whether the agent has accomplished its task: {task}
-    And whether it should proceed to the next step.
-    
-    Your response MUST be valid JSON in the following format:
-    ```json
-    {{
-        "done": <write only "true" or "false">,
-        "summary": "<a short phrase describing what was achieved, and if agent can do something else with its available capabilities.>"
-    }}
-    ```
-    
-    Explanation:
-    {{
-        "done": <whether the agent has done everything it could based on its capabilities>,
-        "summary": "<a short phrase describing what was achieved and how the task was answered, and if agent can do something else with its available capabilities.>"
-    }}
-    """
 
-    llm_response = llm.complete(prompt)
-    response_text = llm_response.text.strip()
+async def aevaluate_task_completion(task: str, context: str, agent_capability: str, llm: MLFlowLLMWrapper) -> AgentRunSummary:
+    """Async `evaluate_task_completion`, to be awaited together with other llm calls."""
+    if SKIP_EMPTY_CONTEXT and context.strip() in _EMPTY_CONTEXTS:
+        return AgentRunSummary(completed=False, summary="Nothing has been done yet, the context is empty.")
 
-    json_match = re.search(r"json.*?(\{.*\})", response_text, re.DOTALL | re.IGNORECASE)
-    code_string = json_match.group(1) if json_match else ""
-    if len(code_string) > 1:
-        response_text = code_string
+    context = clip_tokens(context)
+    cached_summary = _get_cached_task_completion(task, context, agent_capability, llm.model)
+    if cached_summary is not None:
+        return cached_summary
 
-    logger.info(f"Task completion:\n{response_text}.")
+    prompt = _task_completion_prompt(task, context, agent_capability)
+    llm_response = await llm.acomplete_json(
+        prompt, system=task_completion_system_prompt(llm), format=TASK_COMPLETION_SCHEMA, options=TASK_COMPLETION_OPTIONS
+    )
+    try:
+        run_summary = _parse_task_completion(llm_response.text, structured=llm.structured_outputs)
+    except PARSE_ERRORS as e:
+        logger.warning("Task completion is not parsable, resampling: %s", e)
+        run_summary = await _aresample_task_completion(prompt, llm)
+    _cache_task_completion(task, context, agent_capability, llm.model, run_summary)
 
-    data = json.loads(response_text)
-    # FIXME: either make parsing more robust or do manually
-    if isinstance(data["done"], bool):
-        data["done"] = str(data["done"])
+    return run_summary
 
-    return AgentRunSummary(
-        completed=True if data.get("done") in ["True", "true", "yes", "1"] else False,
-        # FIXME: summary is not being used anywhere, at least log it? 
-        summary=data.get("summary", "did-not-parse"),
+
+async def areflect_and_evaluate(
+    task: str,
+    context: str,
+    agent_capability: str,
+    llm: MLFlowLLMWrapper,
+) -> tuple[str, AgentRunSummary]:
+    """
+    Reflection on the progress and the task completion verdict in a single llm call,
+    the context is prefilled once instead of twice.
+    If the answer cannot be parsed, both are done separately.
+
+    Returns:
+        (reflection, run summary)
+    """
+    if SKIP_EMPTY_CONTEXT and context.strip() in _EMPTY_CONTEXTS:
+        return (
+            await areflect_on_progress(task, context, agent_capability, llm),
+            AgentRunSummary(completed=False, summary="Nothing has been done yet, the context is empty."),
+        )
+
+    context = clip_tokens(context)
+    cache_key = sha256_key("reflect_and_evaluate", llm.model, task, context, agent_capability)
+    cached = RESPONSE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    system = (
+        REFLECT_AND_EVALUATE_STRUCTURED_SYSTEM_PROMPT if llm.structured_outputs else REFLECT_AND_EVALUATE_SYSTEM_PROMPT
     )
+    llm_response = await llm.acomplete_json(
+        _task_completion_prompt(task, context, agent_capability),
+        system=system,
+        format=REFLECT_AND_EVALUATE_SCHEMA,
+        options=REFLECT_AND_EVALUATE_OPTIONS,
+    )
+    try:
+        response_text = llm_response.text.strip() if llm.structured_outputs else strip_json_fence(llm_response.text)
+        data = loads_json(response_text)
+        reflection_and_summary = (
+            str(data["reflection"]).strip(),
+            AgentRunSummary(completed=_is_true(data["done"]), summary=data.get("summary", "did-not-parse")),
+        )
+    except PARSE_ERRORS as e:
+        logger.warning("Reflection and task completion are not parsable, doing them separately: %s", e)
+        return tuple(await asyncio.gather(
+            areflect_on_progress(task, context, agent_capability, llm),
+            aevaluate_task_completion(task, context, agent_capability, llm),
+        ))
+    RESPONSE_CACHE.set(cache_key, reflection_and_summary)
+
+    return reflection_and_summary
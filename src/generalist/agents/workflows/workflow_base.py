@@ -1,3 +1,6 @@
+import asyncio
+import hashlib
+import os
 import tempfile
 from dataclasses import dataclass
 
@@ -8,18 +11,43 @@ from langgraph.graph.state import CompiledStateGraph
 
 from generalist.dialer.core import MLFlowLLMWrapper, LLMResponse
 from generalist.tools import ToolOutputType, get_tool_type, BaseTool
-from generalist.tools.data_model import Message, ShortAnswer
+from generalist.tools.data_model import Message, ShortAnswer, AgentRunSummary
+from generalist.utils import run_coroutine
 from clog import get_logger
-from generalist.agents.workflows.tasks.reflection_evaluation import evaluate_task_completion
+from generalist.agents.workflows.tasks.reflection_evaluation import evaluate_task_completion, aevaluate_task_completion, \
+    areflect_and_evaluate, task_completion_system_prompt
 from generalist.agents.workflows.tasks.plan_action import plan_next_action
-from generalist.agents.workflows.tasks.execute_tool import call_tool
-from generalist.agents.workflows.tasks.reflect import reflect_on_progress
+from generalist.agents.workflows.tasks.execute_tool import call_tool, plan_and_call_tool
+from generalist.agents.workflows.tasks.reflect import areflect_on_progress
+from generalist.agents.workflows.tasks.prompts import PLAN_ACTION_SYSTEM_PROMPT, REFLECTION_SYSTEM_PROMPT
 
 
 MAX_STEPS = 12
+# Plan and call the tool of the first step in a single llm call
+FUSE_FIRST_STEP = os.environ.get("FUSE_FIRST_STEP") == "1"
+# Reflect and evaluate the task completion in a single llm call
+FUSE_REFLECTION = os.environ.get("FUSE_REFLECTION") == "1"
+# Send the static system prompts to the llms when the workflow is created (see `MLFlowLLMWrapper.prewarm`)
+PREWARM = os.environ.get("GENERALIST_PREWARM") == "1"
 logger = get_logger(__name__)
 
 
+def _dedup_messages(messages: list[Message]) -> list[Message]:
+    """Drop messages with the same (normalised) content as an earlier one, e.g. a file that was read twice."""
+    seen = set()
+    unique = []
+    for message in messages:
+        digest = hashlib.blake2b(str(message.content).strip().lower().encode("utf-8"), digest_size=8).digest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        unique.append(message)
+
+    if len(unique) < len(messages):
+        logger.debug("Dropped %d duplicate messages from the context", len(messages) - len(unique))
+    return unique
+
+
 @dataclass
 class ExecuteToolOutput:
     name: str
@@ -36,6 +64,7 @@ class AgentState(TypedDict):
         step: Count of how many cycles (LLM + tool call) have been performed
         plan: Current plan or reasoning about what to do next
         reflection: Reflection on the last tool output and next steps
+        run_summary: Whether the task is completed given the current context
     """
     # Description of what us asked from an agent
     task: str
@@ -47,6 +76,8 @@ class AgentState(TypedDict):
     tool_call_result: ExecuteToolOutput | None
     # Summary of what has been done in the current iteration
     reflection: str | None
+    # Completion verdict for the current context (evaluated together with the reflection)
+    run_summary: AgentRunSummary | None
     # All messages that were produced
     context: list[Message]
     # Summary of the progress to see if the task has been achieved
@@ -70,7 +101,10 @@ class AgentWorkflow:
         llm: MLFlowLLMWrapper,
         context: list[Message],
         task: str,
-        tools: list[BaseTool] | None = None
+        tools: list[BaseTool] | None = None,
+        planner_llm: MLFlowLLMWrapper | None = None,
+        fuse_first_step: bool = FUSE_FIRST_STEP,
+        fuse_reflection: bool = FUSE_REFLECTION,
     ):
         """
         Initialise the workflow builder.
@@ -82,36 +116,75 @@ class AgentWorkflow:
             task: task that needs to be performed
             context: summary of what has been achieved in the previous steps
             tools: list of tools that the llm can call
+            planner_llm: (smaller) llm for the short structured decisions: planning the next action and
+                whether the task is completed, defaults to `llm`
+            fuse_first_step: plan and call the tool of the first step in one llm call (skips the planning node)
+            fuse_reflection: reflect and evaluate the task completion in one llm call (of `llm`)
         """
         self.agent_name = name
         self.agent_capability = agent_capability
         self.llm = llm
-        self.state = AgentState(step=0, task=task, context=context, answers=None, plan=None, reflection=None)
+        self.planner_llm = planner_llm or llm
+        self.fuse_first_step = fuse_first_step
+        self.fuse_reflection = fuse_reflection
+        self.state = AgentState(step=0, task=task, context=context, answers=None, plan=None, reflection=None,
+                                run_summary=None)
         self.tools = tools if tools else self.tools
+        # (messages, dedup) -> rendered context, see `_render_context`
+        self._rendered_contexts: dict[tuple[int, bool], str] = {}
+
+        if PREWARM:
+            self.planner_llm.prewarm([PLAN_ACTION_SYSTEM_PROMPT, task_completion_system_prompt(self.planner_llm)])
+            self.llm.prewarm([REFLECTION_SYSTEM_PROMPT])
+
+    def _render_context(self, context: list[Message], dedup: bool = False) -> str:
+        """
+        The context as it is put into the prompts, rendered once per step and shared by the nodes.
+        Note: the context only grows (one message per step), so the number of messages identifies it.
+        """
+        key = (len(context), dedup)
+        if key not in self._rendered_contexts:
+            self._rendered_contexts = {
+                k: v for k, v in self._rendered_contexts.items() if k[0] == len(context)
+            }
+            self._rendered_contexts[key] = str(_dedup_messages(context) if dedup else context)
+
+        return self._rendered_contexts[key]
 
     def plan_action(self, state: AgentState):
         """Planning node: Reason about what to do next before executing tools."""
         state["plan"] = plan_next_action(
             task=state["task"],
-            context=str(state["context"]),
+            context=self._render_context(state["context"]),
             agent_capability=self.agent_capability,
             tools=self.tools,
             previous_reflection=state.get("reflection"),
-            llm=self.llm,
+            llm=self.planner_llm,
         )
 
-        logger.info(f"[{self.agent_name}] Step_{state['step']}. Plan: {state['plan']}")
+        logger.info("[%s] Step_%s. Plan: %.500s", self.agent_name, state["step"], state["plan"])
         return state
 
     def execute_tool(self, state: AgentState):
-        """Execute a tool based on the current plan."""
-        response = call_tool(
-            task=state["task"],
-            context=str(state["context"]),
-            plan=state["plan"],
-            tools=self.tools,
-            llm=self.llm,
-        )
+        """Execute a tool based on the current plan (or plan the first step at the same time)."""
+        if state["plan"] is None:
+            response = plan_and_call_tool(
+                task=state["task"],
+                context=self._render_context(state["context"]),
+                agent_capability=self.agent_capability,
+                tools=self.tools,
+                llm=self.llm,
+            )
+            state["plan"] = response.text.strip() or state["task"]
+            logger.info("[%s] Step_%s. Plan: %.500s", self.agent_name, state["step"], state["plan"])
+        else:
+            response = call_tool(
+                task=state["task"],
+                context=self._render_context(state["context"]),
+                plan=state["plan"],
+                tools=self.tools,
+                llm=self.llm,
+            )
 
         if "Encountered error" in str(response):
             raise ValueError(f"Stopping early {response}")
@@ -121,7 +194,7 @@ class AgentWorkflow:
             state["tool_call_result"] = ExecuteToolOutput(name=tool_name, type=get_tool_type(tool_name), output=str(response))
         else:
             # TODO: is there a way to handle no-tool-call better?
-            logger.warning(f"No tool was called, response: {response}")
+            logger.warning("No tool was called, response: %.500s", response)
             state["tool_call_result"] = ExecuteToolOutput(name="No tool executed", type=None, output=str(response))
 
         state["step"] += 1
@@ -142,7 +215,7 @@ class AgentWorkflow:
             fp.write(state["tool_call_result"].output)
             link = fp.name
             fp.close()
-            logger.info(f"Wrote {state["tool_call_result"].name} to a file {link}.Output:\n{state["tool_call_result"].output}")
+            logger.info("Wrote %s to a file %s.Output:\n%.500s", state["tool_call_result"].name, link, state["tool_call_result"].output)
             content = (f"Tool '{state["tool_call_result"].name}' was executed for task '{state["plan"]}'. "
                        f"The full output was too large for context and has been written to file: {link}. "
                        f"You MAY use this path to read the output in the next step.")
@@ -159,19 +232,33 @@ class AgentWorkflow:
         return state
 
     def reflect(self, state: AgentState):
-        """Reflection node: Analyze the tool output and determine next steps."""
-        state["reflection"] = reflect_on_progress(
-            task=state["task"],
-            context=str(state["context"]),
-            agent_capability=self.agent_capability,
-            llm=self.llm,
-        )
+        """
+        Reflection node: Analyze the tool output and determine next steps.
+        Both only depend on the task and the context, so the completion of the task is evaluated concurrently
+        (or in the same llm call).
+        """
+        context = self._render_context(state["context"], dedup=True)
+
+        async def _reflect_and_evaluate():
+            if self.fuse_reflection:
+                return await areflect_and_evaluate(state["task"], context, self.agent_capability, llm=self.llm)
+            return await asyncio.gather(
+                areflect_on_progress(state["task"], context, self.agent_capability, llm=self.llm),
+                aevaluate_task_completion(state["task"], context, self.agent_capability, llm=self.planner_llm),
+            )
 
-        logger.info(f"[{self.agent_name}] Step_{state['step']}. Reflection: {state['reflection']}")
+        state["reflection"], state["run_summary"] = run_coroutine(_reflect_and_evaluate())
+
+        logger.info(
+            "[%s] Step_%s. Reflection (%d chars): %.500s",
+            self.agent_name, state["step"], len(state["reflection"]), state["reflection"],
+        )
         return state
 
     def evaluate_completion(self, state: AgentState):
-        decision = evaluate_task_completion(state["task"], str(state["context"]), self.agent_capability, llm=self.llm)
+        decision = state.get("run_summary") or evaluate_task_completion(
+            state["task"], self._render_context(state["context"], dedup=True), self.agent_capability, llm=self.planner_llm
+        )
         # Early stopping if answer exists
         if decision.completed:
             return "end"
@@ -192,7 +279,7 @@ class AgentWorkflow:
         workflow.add_node("reflect", self.reflect)
 
         # Define the flow: plan → execute → process → reflect → evaluate
-        workflow.add_edge(START, "plan_action")
+        workflow.add_edge(START, "execute_tool" if self.fuse_first_step else "plan_action")
         workflow.add_edge("plan_action", "execute_tool")
         workflow.add_edge("execute_tool", "process_tool_output")
         workflow.add_edge("process_tool_output", "reflect")
@@ -0,0 +1,265 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+import ollama
+import orjson
+
+
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "nomic-embed-text")
+
+CACHE_HIT_EXACT = "exact"
+CACHE_HIT_SEMANTIC = "semantic"
+CACHE_MISS = "miss"
+
+_WORD_RE = re.compile(r"\w+")
+_STOPWORDS = frozenset({
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it", "of", "on", "or",
+    "that", "the", "this", "to", "was", "what", "when", "where", "which", "who", "with",
+})
+
+
+def sha256_key(*parts: str) -> str:
+    """Stable key for a tuple of strings (NUL separated, so ("ab", "c") != ("a", "bc"))."""
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+def keywords(text: str) -> frozenset[str]:
+    """Lower-cased words of `text` without stopwords."""
+    return frozenset(word for word in _WORD_RE.findall(text.lower()) if word not in _STOPWORDS)
+
+
+@lru_cache(maxsize=256)
+def ollama_embedding(text: str) -> list[float]:
+    """Embed `text` with the local ollama embedding model."""
+    return ollama.embed(model=EMBEDDING_MODEL, input=text).embeddings[0]
+
+
+class LLMCache:
+    """
+    In-memory LRU cache with a time-to-live for llm outputs that are (close to) pure functions of their inputs.
+    Keep track of hits and misses to see whether caching pays off.
+    """
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 10_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+            del self._entries[key]
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+# Shared cache for deterministic decisions of the agent workflow (reflection, task completion)
+RESPONSE_CACHE = LLMCache(ttl_seconds=float(os.environ.get("LLM_CACHE_TTL", 3600)))
+
+
+class DiskCache:
+    """
+    Persistent (sqlite) cache of llm answers by key, survives restarts (e.g. re-running the same task).
+    Entries expire after `ttl_seconds`.
+    """
+    def __init__(self, path: str | Path, ttl_seconds: float = 7 * 24 * 3600):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        # Note: async calls can run in worker threads, the connection is shared behind a lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        # Readers do not block the writer (e.g. several processes on the same cache), commits need no fsync each
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            # Expired entries are never read again, drop them so the file does not grow without bound
+            self._connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl_seconds,))
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._connection.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            return None
+
+        return row[0]
+
+    def set(self, key: str, value: str):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created) VALUES (?, ?, ?)", (key, value, time.time())
+            )
+
+
+# Answers of greedy decoded llm calls, by model and request (see `MLFlowLLMWrapper`)
+DISK_CACHE = (
+    DiskCache(
+        os.environ.get("LLM_DISK_CACHE_PATH", Path.home() / ".cache" / "generalist" / "llm.sqlite"),
+        ttl_seconds=float(os.environ.get("LLM_DISK_CACHE_TTL", 7 * 24 * 3600)),
+    )
+    if os.environ.get("LLM_DISK_CACHE_ENABLED") else None
+)
+
+
+class SemanticCache:
+    """
+    In-memory cache of llm outputs with two lookup paths:
+     - exact: same scope and same (normalised) text
+     - semantic: same scope and text embedding with cosine similarity >= threshold
+
+    `scope` is a fingerprint of everything the output depends on besides the text itself
+    (e.g. context, available tools), only entries within the same scope are compared.
+    """
+    def __init__(
+        self,
+        embed: Callable[[str], list[float]],
+        threshold: float = 0.9,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600,
+    ):
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._exact = LLMCache(ttl_seconds=ttl_seconds, max_entries=max_entries)
+        self._vectors: dict[str, deque[tuple[float, np.ndarray, Any]]] = {}
+
+    @staticmethod
+    def _normalise(text: str) -> str:
+        return text.strip().lower()
+
+    def _unit_vector(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embed(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, text: str, scope: str = "") -> tuple[str, Any | None]:
+        """
+        Returns:
+            (hit type, cached value): hit type is one of `CACHE_HIT_EXACT`, `CACHE_HIT_SEMANTIC`, `CACHE_MISS`.
+        """
+        value = self._exact.get(sha256_key(scope, self._normalise(text)))
+        if value is not None:
+            return CACHE_HIT_EXACT, value
+
+        entries = self._vectors.get(scope)
+        while entries and time.monotonic() - entries[0][0] > self.ttl_seconds:
+            entries.popleft()
+        if not entries:
+            return CACHE_MISS, None
+
+        query = self._unit_vector(text)
+        _, vectors, values = zip(*entries)
+        similarities = np.stack(vectors) @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.threshold:
+            return CACHE_HIT_SEMANTIC, values[best]
+
+        return CACHE_MISS, None
+
+    def set(self, text: str, value: Any, scope: str = ""):
+        self._exact.set(sha256_key(scope, self._normalise(text)), value)
+
+        entries = self._vectors.setdefault(scope, deque(maxlen=self.max_entries))
+        entries.append((time.monotonic(), self._unit_vector(text), value))
+
+
+def semantic_cache_from_env(name: str, threshold: float) -> SemanticCache | None:
+    """
+    `SemanticCache` over ollama embeddings, configured by the `<NAME>_CACHE_*` environment variables
+    (THRESHOLD, MAX_ENTRIES, TTL). None unless `<NAME>_CACHE_ENABLED` is set.
+    """
+    prefix = f"{name.upper()}_CACHE"
+    if not os.environ.get(f"{prefix}_ENABLED"):
+        return None
+
+    return SemanticCache(
+        embed=ollama_embedding,
+        threshold=float(os.environ.get(f"{prefix}_THRESHOLD", threshold)),
+        max_entries=int(os.environ.get(f"{prefix}_MAX_ENTRIES", 1024)),
+        ttl_seconds=float(os.environ.get(f"{prefix}_TTL", 3600)),
+    )
+
+
+class KeywordCache:
+    """
+    Persistent (JSON lines file) cache of llm outputs, looked up by the keyword overlap of the text:
+    the entry of the same scope with the highest Jaccard similarity >= threshold.
+    Meant for outputs that can be reused as a template across runs (e.g. a plan for a similar task).
+    Keeps the `max_entries` most recent entries, one per scope and keywords.
+    """
+    def __init__(self, path: str | Path, threshold: float = 0.6, max_entries: int = 1000):
+        self.path = Path(path)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: list[tuple[str, frozenset[str], Any]] = []
+        if self.path.exists():
+            with self.path.open("rb") as f:
+                for line in f:
+                    entry = orjson.loads(line)
+                    self._entries.append((entry["scope"], frozenset(entry["keywords"]), entry["value"]))
+            del self._entries[:-max_entries]
+
+    @staticmethod
+    def _line(scope: str, entry_keywords: frozenset[str], value: Any) -> bytes:
+        return orjson.dumps({"scope": scope, "keywords": sorted(entry_keywords), "value": value}) + b"\n"
+
+    def get(self, text: str, scope: str = "") -> Any | None:
+        query = keywords(text)
+        best_similarity, best_value = 0.0, None
+        for entry_scope, entry_keywords, value in self._entries:
+            if entry_scope != scope:
+                continue
+            union = len(query | entry_keywords)
+            similarity = len(query & entry_keywords) / union if union else 0.0
+            if similarity > best_similarity:
+                best_similarity, best_value = similarity, value
+
+        return best_value if best_similarity >= self.threshold else None
+
+    def set(self, text: str, value: Any, scope: str = ""):
+        entry_keywords = keywords(text)
+        # Note: the first entry for the same keywords is kept, it is the one that gets returned anyway
+        if any(entry_scope == scope and keys == entry_keywords for entry_scope, keys, _ in self._entries):
+            return
+        self._entries.append((scope, entry_keywords, value))
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if len(self._entries) <= self.max_entries:
+            with self.path.open("ab") as f:
+                f.write(self._line(scope, entry_keywords, value))
+            return
+
+        # the oldest entry is evicted, the file is rewritten with the remaining ones
+        del self._entries[0]
+        with self.path.open("wb") as f:
+            f.writelines(self._line(*entry) for entry in self._entries)
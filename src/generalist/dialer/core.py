@@ -1,22 +1,29 @@
+import asyncio
 import inspect
-import json
+import os
+import threading
 from abc import ABC
-from typing import Callable, get_origin, Union, get_args, get_type_hints
+from functools import lru_cache
+from typing import Callable, get_origin, Union, get_args, get_type_hints, Iterator, AsyncIterator
 
 import ollama
 import mlflow
+import orjson
 import requests
 
 from browser import ChromeBrowser
 from browser.llm_browser import LLMBrowser
 from clog import get_logger
 from generalist.prompt_modifiers.ollama_tool_call import add_tool_directive, tool_to_llm_schema
-from generalist.prompt_modifiers.utils import parse_out_tool_call
+from generalist.prompt_modifiers.utils import parse_out_tool_call, JsonObjectScanner
+from generalist.dialer.cache import DISK_CACHE, DiskCache, sha256_key
 
 
 logger = get_logger(__name__)
 REQUEST_TIMEOUT = 180
 LOCAL_OLLAMA_QWEN_MODEL_NAME = "qwen2.5:14b"
+# Small (quantized) model for the short, structured planning calls of the agent workflow
+LOCAL_OLLAMA_PLANNER_MODEL_NAME = "qwen2.5:3b-instruct-q8_0"
 
 
 class LLMToolCall:
@@ -36,20 +43,65 @@ class LLMResponse:
         return f"LLMResponse({self.text}) with {str(self.tool_call)}"
 
 
+def chat_messages(prompt: str, system: str | None = None) -> list[dict[str, str]]:
+    """
+    Chat messages for `prompt`, optionally preceded by a system message.
+
+    Keep `system` byte-identical between calls (static instructions only): the backend can then reuse
+    the KV cache of that prefix and only prefill the (variable) user message.
+    """
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.append({"role": "user", "content": prompt})
+
+    return messages
+
+
 class LLMToolsExecutor(ABC):
     """
     Base class for interacting with LLM API's.
     """
     # TODO: replace in the children
     model: str  = "placeholder"
-
-    def complete(self, prompt: str, *args, **kwargs) -> LLMResponse:
+    # Whether `predict_and_call` hands the tool schemas to the backend's tool calling,
+    # then the prompt does not need to list the tools nor describe the output format
+    native_tool_calls: bool = False
+    # Whether the `format` (JSON schema) argument constrains decoding, then the answer is plain JSON (no fence)
+    # and the prompt does not need to describe the output format
+    structured_outputs: bool = False
+    # Whether `prewarm` does anything, e.g. a browser session would answer a full chat turn instead
+    prewarms: bool = False
+
+    def complete(self, prompt: str, system: str | None = None, *args, **kwargs) -> LLMResponse:
         """
-        Just answer the prompt
+        Just answer the prompt, `system` holds the static instructions (if any).
         """
         raise NotImplementedError
 
-    def predict_and_call(self, prompt: str, tools: list[Callable], *args, **kwargs) -> LLMResponse:
+    def prewarm(self, system: str):
+        """
+        Load the model and prefill the (static) system prompt with a one token answer, by default nothing.
+        """
+        pass
+
+    async def acomplete(self, prompt: str, system: str | None = None, **kwargs) -> LLMResponse:
+        """
+        Async `complete`, by default runs the blocking call in a worker thread.
+        """
+        return await asyncio.to_thread(self.complete, prompt, system, **kwargs)
+
+    def stream_complete(self, prompt: str, system: str | None = None, **kwargs) -> Iterator[str]:
+        """
+        Yields the answer in chunks as they are generated, by default as one chunk.
+        """
+        yield self.complete(prompt, system, **kwargs).text
+
+    async def astream_complete(self, prompt: str, system: str | None = None, **kwargs) -> AsyncIterator[str]:
+        """
+        Async `stream_complete`, by default as one chunk.
+        """
+        yield (await self.acomplete(prompt, system, **kwargs)).text
+
+    def predict_and_call(self, prompt: str, tools: list[Callable], system: str | None = None, *args, **kwargs) -> LLMResponse:
         """
         First predicts if we need to use a tool from `tools` based on the `prompt`.
         If yes, calls the tool and returns the result.
@@ -79,18 +131,39 @@ class LLMDialerWithTools(LLMToolsExecutor):
     def __init__(self, host: str, port: int, auth_token: str):
         self._api_base = f"http://{host}:{port}"
         self._auth_token = auth_token
+        # Keep-alive connection to the api, reused by all calls
+        self._session = requests.Session()
+        self._session.headers["Authorization"] = f"Bearer {auth_token}"
 
-    def complete(self, prompt: str, *args, **kwargs) -> LLMResponse:
-        resp = requests.post(
+    def complete(self, prompt: str, system: str | None = None, *args, **kwargs) -> LLMResponse:
+        resp = self._session.post(
             f"{self._api_base}/api/chat",
-            json={"model": "web", "messages": [{"role": "user", "content": prompt}], "stream": False},
-            headers={"Authorization": f"Bearer {self._auth_token}"},
+            json={"model": "web", "messages": chat_messages(prompt, system), "stream": False},
         )
         resp.raise_for_status()
-        return LLMResponse(json.loads(resp.json())["message"]["content"])
+        # Note: the body is a JSON encoded string of the JSON answer
+        return LLMResponse(orjson.loads(orjson.loads(resp.content))["message"]["content"])
 
-    def predict_and_call(self, prompt: str, tools: list, *args, **kwargs) -> LLMResponse:
-        answer = self.complete(prompt=prompt)
+    def stream_complete(self, prompt: str, system: str | None = None, **kwargs) -> Iterator[str]:
+        """
+        Streams the answer (one JSON object per line), closing the generator closes the connection.
+        """
+        with self._session.post(
+            f"{self._api_base}/api/chat",
+            json={"model": "web", "messages": chat_messages(prompt, system), "stream": True},
+            stream=True,
+        ) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                chunk = orjson.loads(line)
+                if chunk.get("done"):
+                    break
+                yield chunk["message"]["content"]
+
+    def predict_and_call(self, prompt: str, tools: list, system: str | None = None, *args, **kwargs) -> LLMResponse:
+        answer = self.complete(prompt=prompt, system=system)
 
         # FIXME: the tool will be neatly in the response's json. Parsing out is handled by the api.
         tool_call = parse_out_tool_call(answer.text)
@@ -107,19 +180,42 @@ class LLMDialerWithTools(LLMToolsExecutor):
 
 class LLMOllamaWithTools(LLMToolsExecutor):
     """ Also executes tools that are returned by an LLM. """
+    native_tool_calls = True
+    structured_outputs = True
+    prewarms = True
+
     def __init__(self, model:str, request_timeout):
         self.model = model
         self._timeout = request_timeout
 
-    def complete(self, prompt: str, **kwargs) -> LLMResponse:
-        result = ollama.chat(model=self.model, messages=[{"role": "user", "content": prompt}], **kwargs)
+    def complete(self, prompt: str, system: str | None = None, **kwargs) -> LLMResponse:
+        result = ollama.chat(model=self.model, messages=chat_messages(prompt, system), **kwargs)
+        return LLMResponse(result.message.content)
+
+    def prewarm(self, system: str):
+        ollama.chat(model=self.model, messages=chat_messages("ping", system), options={"num_predict": 1})
+
+    async def acomplete(self, prompt: str, system: str | None = None, **kwargs) -> LLMResponse:
+        # Note: the client (and its connection) is closed after the call, async clients are bound to their event loop
+        async with ollama.AsyncClient() as client:
+            result = await client.chat(model=self.model, messages=chat_messages(prompt, system), **kwargs)
         return LLMResponse(result.message.content)
 
-    def predict_and_call(self, prompt: str, tools: list, **kwargs) -> LLMResponse:
+    def stream_complete(self, prompt: str, system: str | None = None, **kwargs) -> Iterator[str]:
+        for chunk in ollama.chat(model=self.model, messages=chat_messages(prompt, system), stream=True, **kwargs):
+            yield chunk.message.content
+
+    async def astream_complete(self, prompt: str, system: str | None = None, **kwargs) -> AsyncIterator[str]:
+        async with ollama.AsyncClient() as client:
+            stream = await client.chat(model=self.model, messages=chat_messages(prompt, system), stream=True, **kwargs)
+            async for chunk in stream:
+                yield chunk.message.content
+
+    def predict_and_call(self, prompt: str, tools: list, system: str | None = None, **kwargs) -> LLMResponse:
         tool_schemas = [tool_to_llm_schema(tool) for tool in tools]
         result = ollama.chat(
             model=self.model,
-            messages=[{"role": "user", "content": prompt}],
+            messages=chat_messages(prompt, system),
             tools=tool_schemas,
             **kwargs,
         )
@@ -142,50 +238,218 @@ class MLFlowLLMWrapper:
     Generic class to wrap calls to llm with MLFlow logging.
     Use this class for debugging LLM calls, monkeypatch the original
     """
-    def __init__(self, llm_instance: LLMToolsExecutor):
+    def __init__(self, llm_instance: LLMToolsExecutor, disk_cache: DiskCache | None = DISK_CACHE):
         self.llm = llm_instance
+        self.disk_cache = disk_cache
+        self._prewarmed: set[str] = set()
 
-    def complete(self, prompt, **kwargs) -> LLMResponse:
-        # Get caller function name and module
-        caller_frame = inspect.currentframe().f_back
+    @property
+    def model(self) -> str:
+        """Backend and model name, cached answers of one model are not returned for another."""
+        return f"{type(self.llm).__name__}:{self.llm.model}"
+
+    @property
+    def native_tool_calls(self) -> bool:
+        return self.llm.native_tool_calls
+
+    @property
+    def structured_outputs(self) -> bool:
+        return self.llm.structured_outputs
+
+    def prewarm(self, system_prompts: list[str]) -> threading.Thread | None:
+        """
+        Send each (static) system prompt once with a one token answer in a background thread:
+        the model gets loaded and the backend can reuse the prefilled prefix, so the first real call is faster.
+        Not logged and not cached, each system prompt is only sent once per instance.
+        Only for backends that support it (`prewarms`).
+        """
+        if not self.llm.prewarms:
+            return None
+        system_prompts = [system for system in system_prompts if system not in self._prewarmed]
+        if not system_prompts:
+            return None
+        self._prewarmed.update(system_prompts)
+
+        def _warm():
+            for system in system_prompts:
+                try:
+                    self.llm.prewarm(system)
+                except Exception as e:
+                    logger.warning("Pre-warming %s failed: %s", self.llm.model, e)
+
+        thread = threading.Thread(target=_warm, daemon=True)
+        thread.start()
+        return thread
+
+    def _disk_cache_key(self, prompt: str, kwargs: dict) -> str | None:
+        """
+        Key of the answer in the disk cache, None if it should not be cached.
+        Only greedy decoded answers are cached (sampled ones are meant to differ), pass `bypass_cache=True` for a fresh one.
+        """
+        bypass_cache = kwargs.pop("bypass_cache", False)
+        if self.disk_cache is None or bypass_cache or kwargs.get("options", {}).get("temperature") != 0:
+            return None
+
+        request = orjson.dumps(kwargs, option=orjson.OPT_SORT_KEYS, default=str).decode()
+        return sha256_key(self.llm.model, prompt, request)
+
+    def _log_call(self, caller_function: str, prompt: str, raw_response: LLMResponse, system: str | None = None):
+        """Log the prompt/response of a call into the active (nested) run."""
+        mlflow.log_metric("prompt_length", len(prompt))
+        mlflow.log_metric("response_length", len(str(raw_response.text)))
+
+        if system:
+            mlflow.log_text(system, f"system_{caller_function}.txt")
+        mlflow.log_text(prompt, f"prompt_{caller_function}.txt")
+        mlflow.log_text(str(raw_response.text), f"response_{caller_function}.txt")
+
+    def _start_run(self, caller_frame):
         caller_function = caller_frame.f_code.co_name
         caller_module = caller_frame.f_globals.get('__name__', 'unknown')
 
-        with mlflow.start_run(nested=True, run_name=f"{self.llm.model}_{caller_function}"):
-            mlflow.log_param("caller", f"{caller_module}.{caller_function}")
-            mlflow.log_param("llm_name", self.llm.model)
+        run = mlflow.start_run(nested=True, run_name=f"{self.llm.model}_{caller_function}")
+        mlflow.log_param("caller", f"{caller_module}.{caller_function}")
+        mlflow.log_param("llm_name", self.llm.model)
+
+        return run
 
+    def complete(self, prompt, **kwargs) -> LLMResponse:
+        cache_key = self._disk_cache_key(prompt, kwargs)
+        if cache_key and (cached_text := self.disk_cache.get(cache_key)) is not None:
+            return LLMResponse(cached_text)
+
+        # Get caller function name and module
+        caller_frame = inspect.currentframe().f_back
+
+        with self._start_run(caller_frame):
             raw_response = self.llm.complete(prompt, **kwargs)
+            self._log_call(caller_frame.f_code.co_name, prompt, raw_response, kwargs.get("system"))
 
-            mlflow.log_metric("prompt_length", len(prompt))
-            mlflow.log_metric("response_length", len(str(raw_response.text)))
+        if cache_key:
+            self.disk_cache.set(cache_key, raw_response.text)
 
-            mlflow.log_text(prompt, f"prompt_{caller_function}.txt")
-            mlflow.log_text(str(raw_response.text), f"response_{caller_function}.txt")
-            
-            return raw_response
+        return raw_response
+
+    async def acomplete(self, prompt, **kwargs) -> LLMResponse:
+        cache_key = self._disk_cache_key(prompt, kwargs)
+        if cache_key and (cached_text := self.disk_cache.get(cache_key)) is not None:
+            return LLMResponse(cached_text)
 
-    def predict_and_call(self, prompt, tools, **kwargs) -> LLMResponse:
         # Get caller function name and module
         caller_frame = inspect.currentframe().f_back
-        caller_function = caller_frame.f_code.co_name
-        caller_module = caller_frame.f_globals.get('__name__', 'unknown')
 
-        with mlflow.start_run(nested=True, run_name=f"{self.llm.model}_{caller_function}"):
-            mlflow.log_param("caller", f"{caller_module}.{caller_function}")
-            mlflow.log_param("llm_name", self.llm.model)
+        # Note: several calls can be awaited concurrently, the (nested) run is only opened after the call returns
+        # so that runs of concurrent calls do not interleave on mlflow's active run stack
+        raw_response = await self.llm.acomplete(prompt, **kwargs)
 
-            raw_response = self.llm.predict_and_call(prompt=prompt, tools=tools, **kwargs)
+        with self._start_run(caller_frame):
+            self._log_call(caller_frame.f_code.co_name, prompt, raw_response, kwargs.get("system"))
+
+        if cache_key:
+            self.disk_cache.set(cache_key, raw_response.text)
+
+        return raw_response
+
+    def stream_complete(self, prompt, **kwargs) -> Iterator[str]:
+        """
+        Yields the answer in chunks as they are generated.
+        The answer is logged once the stream is exhausted or closed by the caller (e.g. after it read what it needs).
+        """
+        caller_frame = inspect.currentframe().f_back
+
+        with self._start_run(caller_frame):
+            deltas = []
+            stream = self.llm.stream_complete(prompt, **kwargs)
+            try:
+                for delta in stream:
+                    deltas.append(delta)
+                    yield delta
+            finally:
+                stream.close()
+                raw_response = LLMResponse("".join(deltas))
+                self._log_call(caller_frame.f_code.co_name, prompt, raw_response, kwargs.get("system"))
+
+    def complete_json(self, prompt, **kwargs) -> LLMResponse:
+        """
+        For prompts that ask for a single JSON object: streams the answer and stops reading
+        as soon as the first JSON object is closed, whatever the llm generates afterward is not waited for.
+        """
+        cache_key = self._disk_cache_key(prompt, kwargs)
+        if cache_key and (cached_text := self.disk_cache.get(cache_key)) is not None:
+            return LLMResponse(cached_text)
+
+        caller_frame = inspect.currentframe().f_back
+
+        with self._start_run(caller_frame):
+            scanner = JsonObjectScanner()
+            deltas = []
+            stream = self.llm.stream_complete(prompt, **kwargs)
+            for delta in stream:
+                deltas.append(delta)
+                if scanner.feed(delta):
+                    break
+            # closing the generator closes the connection, the server stops generating
+            stream.close()
+
+            raw_response = LLMResponse("".join(deltas))
+            self._log_call(caller_frame.f_code.co_name, prompt, raw_response, kwargs.get("system"))
 
-            mlflow.log_metric("prompt_length", len(prompt))
-            mlflow.log_metric("response_length", len(str(raw_response.text)))
+        if cache_key:
+            self.disk_cache.set(cache_key, raw_response.text)
 
-            mlflow.log_text(prompt, f"prompt_{caller_function}.txt")
-            mlflow.log_text(str(raw_response.text), f"response_{caller_function}.txt")
+        return raw_response
+
+    async def acomplete_json(self, prompt, **kwargs) -> LLMResponse:
+        """Async `complete_json`."""
+        cache_key = self._disk_cache_key(prompt, kwargs)
+        if cache_key and (cached_text := self.disk_cache.get(cache_key)) is not None:
+            return LLMResponse(cached_text)
+
+        caller_frame = inspect.currentframe().f_back
+
+        scanner = JsonObjectScanner()
+        deltas = []
+        stream = self.llm.astream_complete(prompt, **kwargs)
+        async for delta in stream:
+            deltas.append(delta)
+            if scanner.feed(delta):
+                break
+        await stream.aclose()
+
+        raw_response = LLMResponse("".join(deltas))
+        with self._start_run(caller_frame):
+            self._log_call(caller_frame.f_code.co_name, prompt, raw_response, kwargs.get("system"))
+
+        if cache_key:
+            self.disk_cache.set(cache_key, raw_response.text)
+
+        return raw_response
+
+    def predict_and_call(self, prompt, tools, **kwargs) -> LLMResponse:
+        # Get caller function name and module
+        caller_frame = inspect.currentframe().f_back
+
+        with self._start_run(caller_frame):
+            raw_response = self.llm.predict_and_call(prompt=prompt, tools=tools, **kwargs)
+            self._log_call(caller_frame.f_code.co_name, prompt, raw_response, kwargs.get("system"))
 
             return raw_response
 
 
+@lru_cache(maxsize=1)
+def planner_llm_from_env() -> MLFlowLLMWrapper | None:
+    """
+    Ollama llm for the planning calls of the agent workflow, shared by the agents of the process.
+    None (the agents plan with their main llm) unless `PLANNER_LLM_ENABLED` is set,
+    the model is `PLANNER_MODEL` (default `LOCAL_OLLAMA_PLANNER_MODEL_NAME`).
+    """
+    if not os.environ.get("PLANNER_LLM_ENABLED"):
+        return None
+
+    model = os.environ.get("PLANNER_MODEL", LOCAL_OLLAMA_PLANNER_MODEL_NAME)
+    return MLFlowLLMWrapper(llm_instance=LLMOllamaWithTools(model, request_timeout=REQUEST_TIMEOUT))
+
+
 if __name__ == "__main__":
     dialer = LLMDialerWithTools(host="localhost", port=8000, auth_token="0000")
     print(dialer.complete("What was the capital of Prussia?"))
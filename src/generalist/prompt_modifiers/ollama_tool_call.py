@@ -86,9 +86,9 @@ def add_tool_directive(prompt: str):
     ```
     """
     prompt_delta = """
-    Unless the use is asking for a PLAN or REFLECTION, you should output exactly one JSON tool call. 
-     
-    Example (assumed tools:[get_weather]): 
+    Unless the use is asking for a PLAN or REFLECTION, you should output exactly one JSON tool call.
+
+    Example (assumed tools:[get_weather]):
     ''```json
     {
         "function": {
@@ -100,20 +100,20 @@ def add_tool_directive(prompt: str):
         }
     }
     ```''
-    
+
     Only output a single json in the exact format:
     ''```json
     {
         "function": {
             "name": "<tool_name>",
-            "arguments": 
+            "arguments":
                 {
                     <arguments also in json format that given in ur prompt>
                 }
     }
     ```''
-    Use this exact structure, substituting the tool name and arguments from the available tools.                                                                                                                                      
-    Do not modify or expand any file paths you are given.    
+    Use this exact structure, substituting the tool name and arguments from the available tools.
+    Do not modify or expand any file paths you are given.
     """
 
     return "You should help me with this, please:\n" + prompt + "\n" + prompt_delta
\ No newline at end of file
@@ -1,5 +1,37 @@
-import json
 import re
+from typing import Any
+
+import orjson
+
+
+# Backslashes that do not start a valid JSON escape (e.g. windows paths, latex) and commas before a closing bracket
+# Note: valid escape pairs are matched (and kept) first, so the second backslash of an escaped one is not doubled
+_ESCAPE_RE = re.compile(r'\\(["\\/bfnrt]|u[0-9a-fA-F]{4})|\\')
+# Windows paths with single (unescaped) backslashes, e.g. "C:\new\table.csv": `\n` and `\t` would parse as control chars
+# (up to the end of the string, an escaped quote or an escaped backslash)
+_WINDOWS_PATH_RE = re.compile(r'(?<![\w\\])[A-Za-z]:\\(?![\\"])(?:[^"\\]|\\(?!["\\]))*')
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_JSON_MARKER_RE = re.compile("json", re.IGNORECASE)
+
+
+def _escape_windows_paths(text: str) -> str:
+    return _WINDOWS_PATH_RE.sub(lambda match: match.group(0).replace("\\", "\\\\"), text)
+
+
+def loads_json(text: str) -> Any:
+    """
+    Strict `orjson.loads`, only if that fails the usual llm mistakes are repaired (invalid escapes, trailing commas)
+    and the text is parsed once more.
+    Backslashes of windows paths are always escaped first, they are meant literally.
+    """
+    text = _escape_windows_paths(text)
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        escaped = _ESCAPE_RE.sub(lambda match: match.group(0) if match.group(1) else r"\\", text)
+        repaired = _TRAILING_COMMA_RE.sub(r"\1", escaped)
+        return orjson.loads(repaired)
+
 
 def parse_out_tool_call(raw_llm_answer: str) -> dict | None:
     """
@@ -36,10 +68,78 @@ def parse_out_tool_call(raw_llm_answer: str) -> dict | None:
     }
     ```
     """
-    tool_call = None
+    json_object = _extract_json_object(raw_llm_answer)
+
+    return loads_json(json_object) if json_object else None
+
+
+def _extract_json_object(text: str) -> str | None:
+    """
+    From the first "{" after a "json" (fence) marker up to the last "}" of `text`, None if there is no such span.
+    """
+    marker = _JSON_MARKER_RE.search(text)
+    if marker is None:
+        return None
+
+    start = text.find("{", marker.end())
+    end = text.rfind("}")
+    if start == -1 or end < start:
+        return None
+
+    return text[start:end + 1]
+
+
+def strip_json_fence(text: str) -> str:
+    """
+    Content of the first ```json fence in `text`, or `text` itself if there is none.
+    The closing fence may be missing, e.g. when the stream was stopped right after the JSON object.
+    """
+    start = text.find("```json")
+    if start == -1:
+        return text.strip()
+
+    start += len("```json")
+    end = text.find("```", start)
+
+    return text[start:end if end != -1 else len(text)].strip()
+
+
+class JsonObjectScanner:
+    """
+    Incrementally tracks a (streamed) llm answer and tells when the first top-level JSON object is closed.
+    Braces inside JSON strings are ignored.
+
+    Example:
+        scanner = JsonObjectScanner()
+        scanner.feed('```json\n{"done": "tr')  # False
+        scanner.feed('ue", "summary": "{x}"}')  # True
+    """
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.done = False
+
+    def feed(self, chunk: str) -> bool:
+        if self.done:
+            return True
 
-    json_match = re.search(r"json.*?(\{.*\})", raw_llm_answer, re.DOTALL | re.IGNORECASE)
-    if json_match:
-        tool_call = json.loads(json_match.group(1))
+        for char in chunk:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"' and self.depth > 0:
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.done = True
+                    break
 
-    return tool_call
\ No newline at end of file
+        return self.done
@@ -8,6 +8,33 @@ from clog import get_logger
 
 
 logger = get_logger(__name__)
+PARQUET_BATCH_SIZE = 100_000
+_EXCEL_SUFFIXES = frozenset({".xlsx", ".xls"})
+# Greedy decoding, generated scripts are short: cap the decoded tokens
+WRITE_CODE_OPTIONS = {"temperature": 0, "num_predict": 2048}
+
+WRITE_CODE_PROMPT = """Generate clean, executable Python code to accomplish the task below.
+
+Requirements:
+- Generate complete and executable Python code, do not assume or make up path files that were not given in this prompt
+- If needed, use standard Python libraries and/or common packages (pandas, numpy, matplotlib, nltk, beautifulsoup4, etc.)
+- If needed, read the file at the given path and perform the requested task
+- Handle potential errors gracefully
+
+Return the Python code, within python formatting, i.e., ``python <your code> ```
+
+Task: {task}
+
+Context: {context}"""
+
+# Body of the ```python block in the llm output: everything after the opening fence up to the closing one (or the end)
+_FENCE_RE = re.compile(r"python\s*\n(.+?)\s*(?:```|\Z)", re.DOTALL | re.IGNORECASE)
+
+
+def _code_block_closed(text: str) -> bool:
+    """Whether the ```python block in the (partial) llm output is already closed."""
+    opening = text.lower().find("```python")
+    return opening != -1 and text.find("```", opening + len("```python")) != -1
 
 
 class TableEdaTool(BaseTool):
@@ -31,40 +58,30 @@ class TableEdaTool(BaseTool):
 
         try:
             if file_ext == '.csv':
-                df = pd.read_csv(file_path)
-            elif file_ext in ['.xlsx', '.xls']:
-                df = pd.read_excel(file_path)
+                stats = _frame_stats(pd.read_csv(file_path))
+            elif file_ext in _EXCEL_SUFFIXES:
+                stats = _frame_stats(pd.read_excel(file_path))
             elif file_ext == '.parquet':
-                df = pd.read_parquet(file_path)
+                stats = _parquet_stats(file_path)
             else:
                 return f"Unsupported file format: {file_ext}. Supported formats: csv, xlsx, xls, parquet"
 
+            n_rows, columns, dtypes, col_stats = stats
             output = []
             output.append(f"=== Exploratory Data Analysis for {Path(file_path).name} ===")
-            output.append(f"Shape: {df.shape[0]} rows x {df.shape[1]} columns")
+            output.append(f"Shape: {n_rows} rows x {len(columns)} columns")
             output.append("--- Column Information ---")
-            output.append(f"Columns: {list(df.columns)}")
+            output.append(f"Columns: {columns}")
             output.append("--- Data Types ---")
-            output.append(str(df.dtypes))
+            output.append(str(dtypes))
             output.append("--- Summary Statistics ---")
-            nans = df.isna().sum()
-            counts = df.count()
-            for col in df.columns:
-                ser = df[col]
-                nans_v = int(nans[col])
-                count_v = int(counts[col])
-                mean_v = ser.mean() if pd.api.types.is_numeric_dtype(ser) else None
-                try:
-                    min_v = ser.min()
-                    max_v = ser.max()
-                except Exception:
-                    min_v = None
-                    max_v = None
+            for col in columns:
+                s = col_stats[col]
                 output.append(f"Column: {col}")
-                output.append(f"  nans: {nans_v} | count: {count_v}")
-                output.append(f"  mean: {mean_v} | min: {min_v} | max: {max_v}")
+                output.append(f"  nans: {s['nans']} | count: {s['count']}")
+                output.append(f"  mean: {s['mean']} | min: {s['min']} | max: {s['max']}")
             output.append("--- Missing Values ---")
-            missing = df.isnull().sum()
+            missing = pd.Series({col: col_stats[col]["nans"] for col in columns}, dtype="int64")
             if missing.sum() > 0:
                 output.append(str(missing[missing > 0]))
             else:
@@ -77,6 +94,83 @@ class TableEdaTool(BaseTool):
             return f"Error performing EDA: {str(e)}"
 
 
+def _frame_stats(df) -> tuple[int, list, object, dict]:
+    """Column statistics of an in-memory DataFrame: (n_rows, columns, dtypes, {col: stats})."""
+    import pandas as pd
+
+    nans = df.isna().sum()
+    counts = df.count()
+    col_stats = {}
+    for col in df.columns:
+        ser = df[col]
+        try:
+            min_v = ser.min()
+            max_v = ser.max()
+        except Exception:
+            min_v = None
+            max_v = None
+        col_stats[col] = {
+            "nans": int(nans[col]),
+            "count": int(counts[col]),
+            "mean": ser.mean() if pd.api.types.is_numeric_dtype(ser) else None,
+            "min": min_v,
+            "max": max_v,
+        }
+
+    return df.shape[0], list(df.columns), df.dtypes, col_stats
+
+
+def _parquet_stats(file_path: str, batch_size: int = PARQUET_BATCH_SIZE) -> tuple[int, list, object, dict]:
+    """
+    Same statistics as `_frame_stats`, but streamed over parquet record batches.
+    Peak memory is one batch instead of the whole table.
+
+    Note: the mean is merged batch by batch (count weighted running mean), min/max are running extremes.
+    """
+    import pandas as pd
+    import pyarrow.parquet as pq
+
+    pf = pq.ParquetFile(file_path)
+    # Note: the pandas conversion (as for the batches) moves a stored index out of the columns, as `pd.read_parquet` does
+    empty = pf.schema_arrow.empty_table().to_pandas()
+    columns = list(empty.columns)
+    dtypes = empty.dtypes
+    col_stats = {col: {"nans": 0, "count": 0, "mean": None, "min": None, "max": None} for col in columns}
+    numeric = {col for col in columns if pd.api.types.is_numeric_dtype(dtypes[col])}
+    unorderable = set()
+
+    for batch in pf.iter_batches(batch_size=batch_size):
+        chunk = batch.to_pandas()
+        nans = chunk.isna().sum()
+        counts = chunk.count()
+        for col in columns:
+            s = col_stats[col]
+            ser = chunk[col]
+            n_batch = int(counts[col])
+            s["nans"] += int(nans[col])
+            if n_batch == 0:
+                continue
+
+            if col in numeric:
+                batch_mean = ser.mean()
+                s["mean"] = batch_mean if s["mean"] is None else s["mean"] + (batch_mean - s["mean"]) * n_batch / (s["count"] + n_batch)
+            s["count"] += n_batch
+
+            if col in unorderable:
+                continue
+            try:
+                batch_min = ser.min()
+                batch_max = ser.max()
+                s["min"] = batch_min if s["min"] is None else min(s["min"], batch_min)
+                s["max"] = batch_max if s["max"] is None else max(s["max"], batch_max)
+            except Exception:
+                unorderable.add(col)
+                s["min"] = None
+                s["max"] = None
+
+    return pf.metadata.num_rows, columns, dtypes, col_stats
+
+
 class WriteCodeTool(BaseTool):
     name = "write_code"
     description = "Writes Python code that accomplishes a task, optionally using provided context."
@@ -95,29 +189,24 @@ class WriteCodeTool(BaseTool):
         Returns:
             str: Generated Python code.
         """
-        prompt = f"""Generate clean, executable Python code to accomplish the following task.
-
-Task: {task}
-
-Context: {context}
-
-Requirements:
-- Generate complete and executable Python code, do not assume or make up path files that were not given in this prompt
-- If needed, use standard Python libraries and/or common packages (pandas, numpy, matplotlib, nltk, beautifulsoup4, etc.)
-- If needed, read the file at the given path and perform the requested task
-- Handle potential errors gracefully
-
-Return the Python code, within python formatting, i.e., ``python <your code> ```"""
+        prompt = WRITE_CODE_PROMPT.format(task=task, context=context)
 
         try:
-            response = self.llm.complete(prompt)
-            logger.info(f"Generated code for task: {task}\nRaw Output:\n{response.text}")
-
-            python_match = re.search(r"python\s*\n(.+)", response.text, re.DOTALL | re.IGNORECASE)
+            text = ""
+            stream = self.llm.stream_complete(prompt, options=WRITE_CODE_OPTIONS)
+            for delta in stream:
+                text += delta
+                # whatever follows the code block (e.g. an explanation) is not needed: stop the generation
+                if _code_block_closed(text):
+                    break
+            stream.close()
+            logger.info("Generated code for task: %s\nRaw Output (%d chars):\n%.500s", task, len(text), text)
+
+            python_match = _FENCE_RE.search(text)
             if not python_match:
                 raise ValueError("Python code was not parsed correctly: just output python code (```python <your code> ```) and nothing else.")
 
-            return python_match.group(1)
+            return python_match.group(1).strip()
 
         except Exception as e:
             logger.error(f"Error generating code: {str(e)}")
@@ -164,7 +253,7 @@ class ExecuteCodeTool(BaseTool):
                 output.append("STDERR:")
                 output.append(result.stderr)
 
-            logger.info(f"Executed code from {file_path} {'with error' if result.stderr else 'no error'}")
+            logger.info("Executed code from %s %s", file_path, "with error" if result.stderr else "no error")
             return "\n".join(output) if output else "Code executed successfully with no output."
 
         except subprocess.TimeoutExpired:
@@ -1,11 +1,15 @@
+import asyncio
 import fnmatch
 from pathlib import Path
 
 from clog import get_logger
 from . import BaseTool
+from ..utils import run_coroutine, gather_bounded
 
 GREP_EXCLUDE_PATTERNS = ["*.pyc", "*.log", "*.png", "*.jpg", "*.jpeg", "*.gif", "*.ico", "*.pdf"]
 GREP_EXCLUDE_DIRS = ["__pycache__", ".git", "node_modules", ".venv", ".idea"]
+# Files that are searched at once by `GrepFilesTool` (one worker thread each)
+GREP_MAX_PARALLEL = 16
 
 logger = get_logger(__name__)
 
@@ -16,6 +20,21 @@ def _is_excluded(p: Path) -> bool:
     return any(fnmatch.fnmatch(p.name, pat) for pat in GREP_EXCLUDE_PATTERNS)
 
 
+def _grep_file(file: Path, substrings: list[str]) -> list[str] | None:
+    """
+    Numbered lines of `file` with any of `substrings`, None if the file does not contain all of them (or is unreadable).
+    Only the matching lines are kept, the text of the file is dropped once it is searched.
+    """
+    try:
+        text = file.read_text(encoding="utf-8", errors="ignore")
+    except Exception:
+        return None
+    if not all(s in text for s in substrings):
+        return None
+
+    return [f"  {i+1}: {line}" for i, line in enumerate(text.splitlines()) if any(s in line for s in substrings)]
+
+
 class ReadFileTool(BaseTool):
     name = "read_file"
     description = "Reads and returns the contents of a file."
@@ -130,18 +149,17 @@ class GrepFilesTool(BaseTool):
             return f"Error: Path is not a directory: {directory}"
         try:
             files = [p for p in (path.rglob("*") if recursive else path.iterdir()) if p.is_file() and not _is_excluded(p)]
+            # Note: the files are searched concurrently in worker threads (the reads release the GIL),
+            # at most `GREP_MAX_PARALLEL` files are in memory at once
+            async def _grep_files() -> list[list[str] | None]:
+                return await gather_bounded(
+                    (asyncio.to_thread(_grep_file, file, substrings) for file in files),
+                    max_concurrency=GREP_MAX_PARALLEL,
+                )
+
             results = []
-            for file in files:
-                try:
-                    text = file.read_text(encoding="utf-8", errors="ignore")
-                except Exception:
-                    continue
-                if all(s in text for s in substrings):
-                    matching_lines = [
-                        f"  {i+1}: {line}"
-                        for i, line in enumerate(text.splitlines())
-                        if any(s in line for s in substrings)
-                    ]
+            for file, matching_lines in zip(files, run_coroutine(_grep_files())):
+                if matching_lines is not None:
                     results.append(str(file))
                     results.extend(matching_lines)
             if not results:
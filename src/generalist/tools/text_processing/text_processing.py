@@ -1,33 +1,267 @@
+import asyncio
+import concurrent.futures
+import hashlib
 import os
-
-from langchain_text_splitters import CharacterTextSplitter
+import threading
+from itertools import batched, chain
+from typing import Iterator
 
 from generalist.dialer.core import MLFlowLLMWrapper
+from generalist.dialer.cache import LLMCache, sha256_key
 from generalist.tools import BaseTool
 from generalist.tools.text_processing.utils import parse_config
+from generalist.prompt_modifiers.utils import strip_json_fence, loads_json
+from generalist.utils import run_coroutine
 from clog import get_logger
 
 
 logger = get_logger(__name__)
 
+NOT_FOUND = "NOT FOUND"
 DEFAULT_CHUNK_SIZE = 40000
 DEFAULT_CHUNK_OVERLAP = 500
+# Number of chunks that are sent to the backend at once (it batches concurrent requests)
+DEFAULT_MAX_PARALLEL = 4
+# Greedy decoding, the answer per chunk is short (a finding or 1-2 sentences): cap the decoded tokens
+PROCESS_CHUNK_OPTIONS = {"temperature": 0, "num_predict": 1024}
+# Answers are reused for the same chunk and the same task
+# Note: exact matches only, a similar task (e.g. "count rows for 2019" and "for 2020") may need a different answer
+CHUNK_CACHE = (
+    LLMCache(
+        ttl_seconds=float(os.environ.get("CHUNK_CACHE_TTL", 3600)),
+        max_entries=int(os.environ.get("CHUNK_CACHE_MAX_ENTRIES", 1024)),
+    )
+    if os.environ.get("CHUNK_CACHE_ENABLED") else None
+)
+# Chunk answers being generated: a concurrent request for the same chunk and task (e.g. of another agent) waits for it
+_INFLIGHT: dict[str, concurrent.futures.Future] = {}
+_INFLIGHT_LOCK = threading.Lock()
 
+# Note: the static instructions are system prompts, byte-identical across calls, so the backend can reuse their prefill
+PROCESS_CHUNK_SYSTEM_PROMPT = """
+Perform the instruction/task in the user's question.
+Use only the information provided in the context.
+If the text does not contain the relevant info, just output 1-2 short sentence what it contains.
+"""
 
-def _process_chunk(task: str, text: str, llm: MLFlowLLMWrapper) -> str:
-    prompt = f"""
-    Perform the instruction/task in the user's question.
-    Use only the information provided in the context.
-
+PROCESS_CHUNK_PROMPT = """
     TASK:
     {task}
 
     CONTEXT:
     {text}
+    """
+
+# Several (small) chunks in one call, see `_aprocess_chunk_batch`
+PROCESS_CHUNKS_SYSTEM_PROMPT = """
+Perform the instruction/task in the user's question on each of the numbered texts, separately.
+Use only the information provided in that text.
+If a text does not contain the relevant info, just output 1-2 short sentence what it contains.
+Answer with a JSON object {"answers": [...]} with one answer per text, in the order of the texts.
+"""
+
+PROCESS_CHUNKS_PROMPT = """
+    TASK:
+    {task}
+
+    {texts}
+    """
+
+# Answers of the chunks are combined in one more call, the answer to the whole text is not much longer than per chunk
+REDUCE_OPTIONS = {"temperature": 0, "num_predict": 1024}
+
+REDUCE_SYSTEM_PROMPT = """
+Combine the partial answers into a single answer to the task.
+The partial answers were found in consecutive parts of the same text, in that order.
+Keep all relevant details (names, numbers, dates), drop duplicates and parts that are not relevant to the task.
+"""
+
+REDUCE_PROMPT = """
+    TASK:
+    {task}
 
-    If the text does not contain the relevant info, just output 1-2 short sentence what it contains.  
+    PARTIAL ANSWERS:
+    {answers}
     """
-    return llm.complete(prompt).text
+
+
+async def _aprocess_chunk(task: str, text: str, llm: MLFlowLLMWrapper) -> str:
+    # Note: a concurrent.futures.Future can be awaited from any thread and event loop (`run_coroutine` may start new ones)
+    # the same key identifies the request in flight and its cached answer
+    task = task.strip()
+    request_key = sha256_key("process_chunk", llm.llm.model, task, text)
+    with _INFLIGHT_LOCK:
+        inflight = _INFLIGHT.get(request_key)
+        if inflight is None:
+            _INFLIGHT[request_key] = future = concurrent.futures.Future()
+    if inflight is not None:
+        return await asyncio.wrap_future(inflight)
+
+    try:
+        result = await _aanswer_chunk(task, text, llm, request_key)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _INFLIGHT_LOCK:
+            del _INFLIGHT[request_key]
+
+
+async def _aanswer_chunk(task: str, text: str, llm: MLFlowLLMWrapper, cache_key: str) -> str:
+    if CHUNK_CACHE:
+        cached_result = CHUNK_CACHE.get(cache_key)
+        logger.info("chunk_cache hit=%s", cached_result is not None)
+        if cached_result is not None:
+            return cached_result
+
+    prompt = PROCESS_CHUNK_PROMPT.format(task=task, text=text)
+    result = (await llm.acomplete(prompt, system=PROCESS_CHUNK_SYSTEM_PROMPT, options=PROCESS_CHUNK_OPTIONS)).text
+    # Negative answers are not cached, they may be a miss of the llm
+    if CHUNK_CACHE and not result.lstrip().startswith(NOT_FOUND):
+        CHUNK_CACHE.set(cache_key, result)
+
+    return result
+
+
+async def _aprocess_chunk_batch(task: str, chunks: list[str], llm: MLFlowLLMWrapper) -> list[str]:
+    """
+    Performs `task` on each of `chunks` in a single llm call (one prefill and round trip for all of them).
+    If the answers cannot be parsed (or their number is off), the chunks are processed one by one.
+    """
+    if len(chunks) == 1:
+        return [await _aprocess_chunk(task, chunks[0], llm)]
+
+    schema = {
+        "type": "object",
+        "properties": {
+            "answers": {"type": "array", "items": {"type": "string"}, "minItems": len(chunks), "maxItems": len(chunks)},
+        },
+        "required": ["answers"],
+    }
+    texts = "\n\n".join(f"TEXT {i}:\n{chunk}" for i, chunk in enumerate(chunks, start=1))
+    response = await llm.acomplete_json(
+        PROCESS_CHUNKS_PROMPT.format(task=task, texts=texts),
+        system=PROCESS_CHUNKS_SYSTEM_PROMPT,
+        format=schema,
+        options={**PROCESS_CHUNK_OPTIONS, "num_predict": PROCESS_CHUNK_OPTIONS["num_predict"] * len(chunks)},
+    )
+    try:
+        answers = loads_json(strip_json_fence(response.text))["answers"]
+        if len(answers) != len(chunks):
+            raise ValueError(f"Got {len(answers)} answers for {len(chunks)} chunks")
+        return [str(answer) for answer in answers]
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning("Answers of the chunk batch are not parsable, processing the chunks one by one: %s", e)
+        return list(await asyncio.gather(*[_aprocess_chunk(task, chunk, llm) for chunk in chunks]))
+
+
+def _local_config() -> dict:
+    conf = parse_config(tool_function="process_text", param="mode")
+    return conf.get("local", {}) if conf else {}
+
+
+def _iter_chunks(text: str, chunk_size: int, chunk_overlap: int) -> Iterator[str]:
+    """
+    Chunks of at most `chunk_size` chars, consecutive ones overlap by up to `chunk_overlap` chars.
+    Chunks end (and start) at a space where possible, so words are not cut in half.
+    """
+    # Note: otherwise the window would not move forward
+    if not 0 <= chunk_overlap < chunk_size:
+        raise ValueError(f"Chunk overlap {chunk_overlap} has to be non-negative and smaller than the chunk size {chunk_size}")
+
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + chunk_size)
+        if end < len(text):
+            # Note: the space has to be past the overlap, otherwise the next chunk would not move forward
+            space = text.rfind(" ", start + chunk_overlap + 1, end)
+            if space != -1:
+                end = space
+        yield text[start:end].strip()
+
+        if end == len(text):
+            return
+        space = text.find(" ", end - chunk_overlap, end)
+        start = space + 1 if space != -1 else end
+
+
+def _split_text(text: str) -> Iterator[str]:
+    """
+    Non-empty chunks of `text` in order, each distinct chunk only once
+    (e.g. repeated boilerplate of a downloaded page would otherwise be processed and answered for again).
+    The chunks are split lazily, while the first ones are being processed.
+    """
+    conf_local = _local_config()
+    chunk_size = conf_local.get("chunk_size", DEFAULT_CHUNK_SIZE)
+    chunk_overlap = conf_local.get("chunk_overlap", DEFAULT_CHUNK_OVERLAP)
+
+    seen = set()
+    for chunk in _iter_chunks(text, chunk_size, chunk_overlap):
+        digest = hashlib.blake2b(chunk.encode("utf-8"), digest_size=16).digest()
+        if chunk and digest not in seen:
+            seen.add(digest)
+            yield chunk
+
+
+async def aprocess_text(task: str, text: str, llm: MLFlowLLMWrapper) -> list[str]:
+    """
+    Performs `task` on every chunk of `text` concurrently.
+
+    Returns:
+        The answers of the chunks where the information was found, in the order of the chunks.
+    """
+    conf_local = _local_config()
+    # Note: one chunk per call by default, batch several for small chunks (the prefill and round trip are shared)
+    chunks_per_call = conf_local.get("chunks_per_call", 1)
+    # Note: the environment (e.g. a backend with more parallel slots) takes precedence over the config
+    max_parallel = int(os.environ.get("PROCESS_CHUNK_MAX_PARALLEL", conf_local.get("max_parallel", DEFAULT_MAX_PARALLEL)))
+
+    # Batches are split into a bounded queue and taken by `max_parallel` workers, so the first llm calls start
+    # before the whole (multi MB) text is split and at most a few batches are split ahead of the workers
+    queue: asyncio.Queue[tuple[int, tuple[str, ...]] | None] = asyncio.Queue(maxsize=2 * max_parallel)
+    batch_results: dict[int, list[str]] = {}
+
+    async def _split():
+        for i, batch in enumerate(batched(_split_text(text), chunks_per_call)):
+            await queue.put((i, batch))
+        for _ in range(max_parallel):
+            await queue.put(None)
+
+    async def _process():
+        while (item := await queue.get()) is not None:
+            i, batch = item
+            batch_results[i] = await _aprocess_chunk_batch(task, list(batch), llm)
+
+    # Note: the task group cancels the other workers on a failure, its first cause is raised as is (not as a group)
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(_split())
+            for _ in range(max_parallel):
+                group.create_task(_process())
+    except ExceptionGroup as e:
+        raise e.exceptions[0]
+
+    results = chain.from_iterable(batch_results[i] for i in sorted(batch_results))
+
+    return [result for result in results if not result.lstrip().startswith(NOT_FOUND)]
+
+
+def process_text_with_reduce(task: str, text: str, llm: MLFlowLLMWrapper) -> str:
+    """
+    Performs `task` on every chunk of `text` (map) and combines the answers of the chunks into one (reduce),
+    the reduce call is only made if more than one chunk has an answer.
+    """
+    async def _map_reduce() -> str:
+        answers = await aprocess_text(task, text, llm)
+        if len(answers) <= 1:
+            return answers[0] if answers else NOT_FOUND
+
+        prompt = REDUCE_PROMPT.format(task=task, answers="\n\n".join(answers))
+        return (await llm.acomplete(prompt, system=REDUCE_SYSTEM_PROMPT, options=REDUCE_OPTIONS)).text
+
+    return run_coroutine(_map_reduce())
 
 
 class ProcessTextFileTool(BaseTool):
@@ -47,7 +281,7 @@ class ProcessTextFileTool(BaseTool):
             task: Instruction to perform on the file content (e.g. "Summarise this text", "Extract all dates").
 
         Returns:
-            str: Concatenated results from all chunks where the information was found.
+            str: Result for the whole file, combined from all chunks where the information was found.
         """
         try:
             with open(os.path.expanduser(file_path), "r", encoding="utf-8") as f:
@@ -56,19 +290,8 @@ class ProcessTextFileTool(BaseTool):
             logger.error(f"Failed to read file {file_path}: {e}")
             return f"Error reading file: {e}"
 
-        conf = parse_config(tool_function="process_text", param="mode")
-        conf_local = conf.get("local", {}) if conf else {}
-        chunk_size = conf_local.get("chunk_size", DEFAULT_CHUNK_SIZE)
-        chunk_overlap = conf_local.get("chunk_overlap", DEFAULT_CHUNK_OVERLAP)
-
-        splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, separator=" ")
-        chunks = splitter.split_text(text)
-
-        responses = []
-        for chunk in chunks:
-            if chunk:
-                result = _process_chunk(task, chunk, self.llm)
-                if "NOT FOUND" not in result:
-                    responses.append(result)
-
-        return "\n\n".join(responses) if responses else "NOT FOUND"
\ No newline at end of file
+        try:
+            return process_text_with_reduce(task, text, self.llm)
+        except Exception as e:
+            logger.error(f"Failed to process file {file_path}: {e}")
+            return f"Error processing file: {e}"
\ No newline at end of file
@@ -1,28 +1,81 @@
-import yaml
+import re
+from functools import lru_cache
 from pathlib import Path
+from typing import Collection
+
+import yaml
+
+
+# urls (with a scheme or starting with www.), unix-like paths with at least one directory or windows paths
+_RESOURCE_LINK_RE = re.compile(
+    r"(?:https?|ftp|file)://[^\s<>\"'`]+"
+    r"|www\.[^\s<>\"'`]+"
+    r"|(?<![\w:/.~])(?:~|\.{1,2})?/(?:[\w.-]+/)+[\w.-]+"
+    r"|(?<!\w)[A-Za-z]:\\(?:[\w.-]+\\)*[\w.-]+"
+)
+# punctuation that ends a sentence rather than the link
+_LINK_TRAILING_CHARS = ".,;:!?)]}"
+# Links of resources that are not on the local file system
+_REMOTE_PREFIXES = ("http://", "https://", "www.")
+
+
+@lru_cache(maxsize=1)
+def _load_config() -> dict:
+    """The parsed config.yaml, read once per process (do not modify the returned dict)."""
+    cfg_path = Path(__file__).resolve().parent / "config.yaml"
+    if not cfg_path.exists():
+        return {}
+
+    with cfg_path.open("r") as f:
+        return yaml.safe_load(f) or {}
+
 
 def parse_config(tool_function: str, param: str) -> dict:
     """
     TODO: create error handling?
     """
-    cfg_path = Path(__file__).resolve().parent / "config.yaml"
-    if cfg_path.exists():
-        with cfg_path.open("r") as f:
-            cfg = yaml.safe_load(f) or {}
-        conf_func = cfg.get(tool_function, None)
-        if conf_func:
-            conf_param = conf_func.get(param, None)
+    conf_func = _load_config().get(tool_function, None)
+    if conf_func:
+        conf_param = conf_func.get(param, None)
 
-            return conf_param
+        return conf_param
 
     return None
 
 
 def read_local_file(filepath: str):
-    if not filepath.startswith("http") or filepath.startswith("www"):
-        with open(filepath, "rt") as f:
-            content = f.read()
-    else:
+    if filepath.startswith(_REMOTE_PREFIXES):
         raise ValueError(f"Cannot read from non-local resource {filepath}")
 
-    return content
\ No newline at end of file
+    with open(filepath, "rt") as f:
+        content = f.read()
+
+    return content
+
+
+@lru_cache(maxsize=1024)
+def _first_resource_link(text: str) -> str | None:
+    match = _RESOURCE_LINK_RE.search(text)
+    if not match:
+        return None
+
+    return match.group(0).rstrip(_LINK_TRAILING_CHARS)
+
+
+def parse_out_resource_link(text: str, known_links: Collection[str | None] = ()) -> str | None:
+    """
+    Find the first url or file path mentioned in `text`.
+
+    Args:
+        text: e.g. the user's question
+        known_links: links of the resources that are already available, these are not returned again
+
+    Returns:
+        The url or path, None if `text` does not mention any (new) one.
+    """
+    # Note: the same question is parsed at every step of the workflow, the lookup is cached on the text only
+    link = _first_resource_link(text)
+    if link is None or link in known_links:
+        return None
+
+    return link
@@ -1,22 +1,65 @@
 import asyncio
-import concurrent.futures
+import re
+from functools import lru_cache
 from typing import Optional, List, Dict, Any
+from urllib.parse import urlparse
 
 from browser.search.web import BraveBrowser
-from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, DefaultMarkdownGenerator, CacheMode
+from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, DefaultMarkdownGenerator, CacheMode, \
+    LXMLWebScrapingStrategy
 from ..tools.data_model import WebSearchResult
 from ..dialer.core import MLFlowLLMWrapper
+from ..utils import run_coroutine
+from ..prompt_modifiers.utils import strip_json_fence, loads_json
 from . import BaseTool
 from clog import get_logger
 
 
 NOT_FOUND_LITERAL = "N/A"
 DEFAULT_TIMEOUT = 15.0
+MAX_LINK_LENGTH = 2048
+# Html beyond this size is cut off before the conversion (the main content is at the start, bounds the conversion time)
+MAX_PAGE_SOURCE_CHARS = 2_000_000
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36'
 
 logger = get_logger(__name__)
+# JSON schema of the generated queries ({"1": "<query>", ...}), constrains decoding on backends with structured outputs
+SEARCH_QUERIES_SCHEMA = {
+    "type": "object",
+    "additionalProperties": {"type": "string"},
+}
+SEARCH_QUERIES_OPTIONS = {"temperature": 0, "num_predict": 256}
+
+SEARCH_QUERIES_PROMPT = """
+    Generate up to {max_queries} short, precise search engine queries for the question below.
+
+    Your response MUST be valid JSON in the following format:
+    ```json
+    {{
+        "1": "<first search query>",
+        "2": "<second search query>"
+    }}
+    ```
+
+    Rules:
+    - Output ONLY the JSON object above, nothing else.
+    - Each query must be SHORT and precise.
+    - Provide at most {max_queries} queries.
+
+    Question: "{question}"
+    """
+
+# Runs of blank (or whitespace only) lines and trailing spaces of the markdown
+_BLANK_LINES_RE = re.compile(r"\n(?:[ \t]*\n)+")
+_TRAILING_SPACES_RE = re.compile(r"[ \t]+\n")
+# Page parts without content, removed before the conversion to markdown
+_EXCLUDED_TAGS = ["script", "style", "nav", "footer", "header", "aside", "form", "noscript", "iframe"]
+
 _run_config = CrawlerRunConfig(
     markdown_generator=DefaultMarkdownGenerator(),
+    # lxml (C) parser, less html to convert without the excluded tags
+    scraping_strategy=LXMLWebScrapingStrategy(),
+    excluded_tags=_EXCLUDED_TAGS,
     cache_mode=CacheMode.BYPASS,
 )
 
@@ -26,51 +69,32 @@ async def html_to_markdown(html_content: str, crawler: AsyncWebCrawler) -> str:
     if not result.success:
         raise Exception(f"Failed to convert HTML to Markdown: {result.error_message}")
     md_obj = result.markdown
-    if hasattr(md_obj, 'raw_markdown'):
-        return md_obj.raw_markdown
-    return str(md_obj)
+    markdown = md_obj.raw_markdown if hasattr(md_obj, 'raw_markdown') else str(md_obj)
 
+    return _BLANK_LINES_RE.sub("\n\n", _TRAILING_SPACES_RE.sub("\n", markdown)).strip()
 
-def generate_search_queries(question: str, max_queries: int, llm: MLFlowLLMWrapper) -> list[str]:
-    prompt = f"""
-    Generate up to {max_queries} short, precise search engine queries for the following question: "{question}".
 
-    Your response MUST be valid JSON in the following format:
-    ```json
-    {{
-        "1": "<first search query>",
-        "2": "<second search query>"
-    }}
-    ```
+@lru_cache(maxsize=1024)
+def _search_queries(question: str, max_queries: int, llm: MLFlowLLMWrapper) -> tuple[str, ...]:
+    """
+    Queries are greedy decoded, so the same question gives the same queries (repeats skip the llm call).
+    Note: failures raise and are therefore not cached.
+    """
+    prompt = SEARCH_QUERIES_PROMPT.format(question=question, max_queries=max_queries)
+    response = llm.complete_json(prompt, format=SEARCH_QUERIES_SCHEMA, options=SEARCH_QUERIES_OPTIONS)
+    response_text = response.text if hasattr(response, 'text') else str(response)
+    parsed = loads_json(strip_json_fence(response_text))
+    queries = tuple(v.strip() for v in parsed.values() if isinstance(v, str) and v.strip())
 
-    Example question: "What is the population of the biggest cities in Europe?"
-    Example output:
-    ```json
-    {{
-        "1": "largest cities in Europe by population",
-        "2": "most populated urban areas Europe 2024"
-    }}
-    ```
+    return queries[:max_queries] if queries else (question,)
 
-    Rules:
-    - Output ONLY the JSON object above, nothing else.
-    - Each query must be SHORT and precise.
-    - Provide at most {max_queries} queries.
-    """
 
+def generate_search_queries(question: str, max_queries: int, llm: MLFlowLLMWrapper) -> tuple[str, ...]:
     try:
-        import json
-        import regex as re
-        response = llm.complete(prompt)
-        response_text = response.text if hasattr(response, 'text') else str(response)
-        json_match = re.search(r"json.*?(\{.*\})", response_text, re.DOTALL | re.IGNORECASE)
-        code_string = json_match.group(1) if json_match else response_text.strip()
-        parsed = json.loads(code_string)
-        queries = [v.strip() for v in parsed.values() if isinstance(v, str) and v.strip()]
-        return queries[:max_queries] if queries else [question]
+        return _search_queries(question, max_queries, llm)
     except Exception as e:
         logger.error(f"Query generation failed, falling back to original question: {e}")
-        return [question]
+        return (question,)
 
 
 class WebSearchTool(BaseTool):
@@ -94,7 +118,7 @@ class WebSearchTool(BaseTool):
             A list of dicts with search result metadata and cleaned page content.
         """
         candidate_queries = generate_search_queries(question, n_queries, self.llm)
-        logger.info(f"Generated search queries: {candidate_queries}")
+        logger.info("Generated search queries: %s", candidate_queries)
 
         # FIXME: this should be adjusted later
         n_queries = 1
@@ -110,44 +134,37 @@ class WebSearchTool(BaseTool):
                 logger.error(f"Search session failed for query '{query}': {e}")
 
         unique_results = self._drop_non_unique_links(all_sources)
-        logger.info(f"Retrieved {len(unique_results)} unique links.")
+        logger.info("Retrieved %d unique links.", len(unique_results))
 
         # Async part is needed: because crawl4ai spawns playwright behind the scenes and it takes ~4 seconds to do
         # we wanna proceses all search results in one loop with one playwright instance
         async def _fetch_all() -> List[Dict[str, Any]]:
             async with AsyncWebCrawler(config=BrowserConfig(headless=True)) as crawler:
-                resources = []
+                # Note: the pages are loaded one by one in the same browser tab (in a worker thread, so the event loop
+                # keeps running), each page is converted while the next ones are loading
+                conversions = []
                 for search in unique_results:
-                    content = None
-                    if search.link != NOT_FOUND_LITERAL:
-                        content = await self._download_content(search, crawler)
-                    if not content:
-                        content = search.metadata.get("web_page_summary")
-                    if content and content != NOT_FOUND_LITERAL:
-                        resources.append({"search_result": search, "content": content})
-
-                return resources
-
-        # Python is single threaded by default
-        # There is a single coroutine loop (in python, event loop) per single python thread.
-        # The asyncio.run function creates a new event loop where we can schedule coroutines without blocking the main loop.
-        # We can not schedule on the main loop directly because we are probably already in a running coroutine (e.g., python notebook cell running)
-        # which blocks the main loop, if we start a new blocking (coz by default we only have a single thread and therefore needs to await any coroutine that runs on the thread!) coroutine
-        # we would have to double block that (main) event loop which might be used by other coroutines in the main loop
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = None
+                    page_source = await asyncio.to_thread(self._load_page, search)
+                    conversions.append(asyncio.create_task(self._to_markdown(search, page_source, crawler)))
+                contents = await asyncio.gather(*conversions)
+
+            resources = []
+            for search, content in zip(unique_results, contents):
+                if not content:
+                    content = search.metadata.get("web_page_summary")
+                if content and content != NOT_FOUND_LITERAL:
+                    resources.append({"search_result": search, "content": content})
 
-        if loop and loop.is_running():
-            # Create a thread pool with one thread (managed by OS)
-            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
-                return pool.submit(asyncio.run, _fetch_all()).result()
+            return resources
 
-        return asyncio.run(_fetch_all())
+        return run_coroutine(_fetch_all())
 
-    async def _download_content(self, resource: WebSearchResult, crawler: AsyncWebCrawler) -> Optional[str]:
-        if not resource.link or resource.link == NOT_FOUND_LITERAL or not resource.link.startswith('http'):
+    def _load_page(self, resource: WebSearchResult) -> Optional[str]:
+        """Html of the page at the link, loaded in the search session's browser."""
+        if not resource.link or resource.link == NOT_FOUND_LITERAL or len(resource.link) > MAX_LINK_LENGTH:
+            return None
+        parsed_link = urlparse(resource.link)
+        if parsed_link.scheme not in ("http", "https") or not parsed_link.netloc:
             return None
         try:
             tab_id = "page_search_result"
@@ -161,9 +178,31 @@ class WebSearchTool(BaseTool):
             driver.get(resource.link)
             browser.wait(0.5)
 
-            return await html_to_markdown(driver.page_source, crawler)
+            # e.g. a pdf or an image opened in the viewer of the browser, there is no html to convert
+            content_type = driver.execute_script("return document.contentType") or ""
+            if "html" not in content_type and "xml" not in content_type:
+                logger.info("Skipping %s with content type %s", resource.link, content_type)
+                return None
+
+            page_source = driver.page_source
+            if len(page_source) > MAX_PAGE_SOURCE_CHARS:
+                logger.info("Cutting off the html of %s at %d of %d chars", resource.link, MAX_PAGE_SOURCE_CHARS, len(page_source))
+                page_source = page_source[:MAX_PAGE_SOURCE_CHARS]
+
+            return page_source
+        except Exception as e:
+            logger.error("Unexpected error downloading %s: %s", resource.link, e)
+        return None
+
+    async def _to_markdown(
+        self, resource: WebSearchResult, page_source: Optional[str], crawler: AsyncWebCrawler
+    ) -> Optional[str]:
+        if not page_source:
+            return None
+        try:
+            return await html_to_markdown(page_source, crawler)
         except Exception as e:
-            logger.error(f"Unexpected error downloading {resource.link}: {e}")
+            logger.error("Unexpected error converting %s: %s", resource.link, e)
         return None
 
     def _drop_non_unique_links(self, resources: List[WebSearchResult]) -> List[WebSearchResult]:
@@ -1,5 +1,20 @@
+import asyncio
+import concurrent.futures
+import os
 import textwrap
 import inspect
+from functools import lru_cache
+from typing import Any, Coroutine, Iterable
+
+import tiktoken
+
+from clog import get_logger
+
+
+logger = get_logger(__name__)
+
+# Token budget of the context that is put into a prompt
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", 4096))
 
 
 def pprint(text):
@@ -10,3 +25,66 @@ def pprint(text):
 
 def current_function():
     return inspect.currentframe().f_back.f_code.co_name
+
+
+def run_coroutine(coroutine: Coroutine) -> Any:
+    """
+    Run `coroutine` to completion from synchronous code and return its result.
+    """
+    # Python is single threaded by default
+    # There is a single coroutine loop (in python, event loop) per single python thread.
+    # The asyncio.run function creates a new event loop where we can schedule coroutines without blocking the main loop.
+    # We can not schedule on the main loop directly because we are probably already in a running coroutine (e.g., python notebook cell running)
+    # which blocks the main loop, if we start a new blocking (coz by default we only have a single thread and therefore needs to await any coroutine that runs on the thread!) coroutine
+    # we would have to double block that (main) event loop which might be used by other coroutines in the main loop
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    if loop and loop.is_running():
+        # Create a thread pool with one thread (managed by OS)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(asyncio.run, coroutine).result()
+
+    return asyncio.run(coroutine)
+
+
+async def gather_bounded(coroutines: Iterable[Coroutine], max_concurrency: int) -> list[Any]:
+    """
+    `asyncio.gather` with at most `max_concurrency` coroutines running at once, results are in input order.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _bounded(coroutine: Coroutine) -> Any:
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*[_bounded(coroutine) for coroutine in coroutines])
+
+
+@lru_cache(maxsize=1)
+def _token_encoding() -> tiktoken.Encoding:
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def clip_tokens(text: str, max_tokens: int = CONTEXT_MAX_TOKENS, head_fraction: float = 0.25) -> str:
+    """
+    Keep the first and the last tokens of `text`, `max_tokens` in total of which `head_fraction` from the start:
+    the start of the context holds the given resources (e.g. the user's files), the end the most recent steps.
+    Note: the count is an estimate for the local models (cl100k encoding).
+    """
+    # every token is at least one byte, short texts do not need to be encoded
+    if len(text.encode("utf-8")) <= max_tokens:
+        return text
+
+    token_ids = _token_encoding().encode(text)
+    if len(token_ids) <= max_tokens:
+        return text
+
+    head_tokens = int(max_tokens * head_fraction)
+    tail_tokens = max_tokens - head_tokens
+    logger.debug("Clipped text from %d to the first %d and the last %d tokens", len(token_ids), head_tokens, tail_tokens)
+
+    encoding = _token_encoding()
+    return encoding.decode(token_ids[:head_tokens]) + "\n...\n" + encoding.decode(token_ids[-tail_tokens:])
@@ -0,0 +1,34 @@
+"""
+uv run pytest tests/test_tools/test_iter_chunks.py
+"""
+import pytest
+
+from generalist.tools.text_processing.text_processing import _iter_chunks
+
+
+TEXT = " ".join(f"word{i}" for i in range(1000))
+
+
+def test_chunks_cover_the_whole_text():
+    chunks = list(_iter_chunks(TEXT, 200, 50))
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert TEXT.startswith(chunks[0]) and TEXT.endswith(chunks[-1])
+    assert {word for chunk in chunks for word in chunk.split(" ")} == set(TEXT.split(" "))
+
+
+def test_consecutive_chunks_overlap_and_are_cut_at_spaces():
+    chunks = list(_iter_chunks(TEXT, 200, 50))
+    for chunk, next_chunk in zip(chunks, chunks[1:]):
+        # every chunk consists of whole words only
+        assert set(chunk.split(" ")) <= set(TEXT.split(" "))
+        assert next_chunk.split(" ")[0] in chunk.split(" ")
+
+
+def test_text_without_spaces_is_cut_at_the_chunk_size():
+    assert list(_iter_chunks("x" * 25, 10, 2)) == ["x" * 10, "x" * 10, "x" * 5]
+
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(100, 150), (100, 100), (100, -1)])
+def test_overlap_not_smaller_than_chunk_size_is_rejected(chunk_size, chunk_overlap):
+    with pytest.raises(ValueError):
+        next(_iter_chunks(TEXT, chunk_size, chunk_overlap))
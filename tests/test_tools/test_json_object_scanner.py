@@ -0,0 +1,33 @@
+"""
+uv run pytest tests/test_tools/test_json_object_scanner.py
+"""
+from generalist.prompt_modifiers.utils import JsonObjectScanner
+
+
+def _feed_all(chunks: list[str]) -> int | None:
+    """Returns the index of the chunk that closed the first object."""
+    scanner = JsonObjectScanner()
+    for i, chunk in enumerate(chunks):
+        if scanner.feed(chunk):
+            return i
+    return None
+
+
+def test_closes_on_last_brace():
+    assert _feed_all(['```json\n{"done": "tr', 'ue", ', '"summary": "ok"}', "\n```", " trailing text"]) == 2
+
+
+def test_nested_objects():
+    assert _feed_all(['{"a": {"b": 1}', ', "c": 2', "}"]) == 2
+
+
+def test_braces_inside_strings_are_ignored():
+    assert _feed_all(['{"summary": "a } and { b"', ', "x": "\\"}"', "}"]) == 2
+
+
+def test_prose_quotes_before_json_are_ignored():
+    assert _feed_all(['Here is "the" answer: ', '{"done": "false"}']) == 1
+
+
+def test_no_json():
+    assert _feed_all(["Just a plain text answer", " with no json."]) is None
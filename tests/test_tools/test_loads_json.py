@@ -0,0 +1,41 @@
+"""
+uv run pytest tests/test_tools/test_loads_json.py
+"""
+import orjson
+import pytest
+
+from generalist.prompt_modifiers.utils import loads_json
+
+
+def test_valid_json_is_not_touched():
+    assert loads_json('{"path": "a\\\\b", "text": "line\\nnext"}') == {"path": "a\\b", "text": "line\nnext"}
+
+
+def test_invalid_escape_is_repaired():
+    assert loads_json('{"path": "C:\\Users\\me\\data.csv"}') == {"path": "C:\\Users\\me\\data.csv"}
+
+
+def test_escaped_backslashes_are_kept_when_repairing():
+    assert loads_json(r'{"path": "C:\\Users\\me\\data.csv",}') == {"path": "C:\\Users\\me\\data.csv"}
+
+
+def test_invalid_unicode_escape_is_repaired():
+    assert loads_json(r'{"text": "see \user manual"}') == {"text": "see \\user manual"}
+    assert loads_json(r'{"path": "c:\users\me"}') == {"path": "c:\\users\\me"}
+
+
+def test_windows_path_is_not_decoded_as_escapes():
+    assert loads_json(r'{"path": "C:\new\table.csv"}') == {"path": "C:\\new\\table.csv"}
+
+
+def test_windows_path_is_not_decoded_as_escapes_when_repairing():
+    assert loads_json(r'{"path": "C:\new\data\b.csv",}') == {"path": "C:\\new\\data\\b.csv"}
+
+
+def test_trailing_comma_is_repaired():
+    assert loads_json('{"1": "first query", "2": "second query",\n}') == {"1": "first query", "2": "second query"}
+
+
+def test_unrepairable_json_raises():
+    with pytest.raises(orjson.JSONDecodeError):
+        loads_json('{"done": ')
@@ -0,0 +1,29 @@
+"""
+uv run pytest tests/test_tools/test_parse_out_resource_link.py
+"""
+import pytest
+
+from generalist.tools.text_processing.utils import parse_out_resource_link
+
+
+@pytest.mark.parametrize(
+    "text, link",
+    [
+        ("Summarise https://en.wikipedia.org/wiki/Prussia.", "https://en.wikipedia.org/wiki/Prussia"),
+        ("What is on www.example.com/page?", "www.example.com/page"),
+        ("Read the attached file /data/gaia/2023/task.xlsx and count rows", "/data/gaia/2023/task.xlsx"),
+        ("Look into ./files/notes.txt, then answer", "./files/notes.txt"),
+        ("Open C:\\Users\\me\\report.docx.", "C:\\Users\\me\\report.docx"),
+    ],
+)
+def test_finds_link(text, link):
+    assert parse_out_resource_link(text) == link
+
+
+def test_no_link():
+    assert parse_out_resource_link("What was the capital of Prussia in 1871 and/or 1900?") is None
+
+
+def test_known_link_is_not_returned_again():
+    text = "Summarise https://en.wikipedia.org/wiki/Prussia"
+    assert parse_out_resource_link(text, known_links=["https://en.wikipedia.org/wiki/Prussia"]) is None
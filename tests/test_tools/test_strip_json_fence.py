@@ -0,0 +1,16 @@
+"""
+uv run pytest tests/test_tools/test_strip_json_fence.py
+"""
+from generalist.prompt_modifiers.utils import strip_json_fence
+
+
+def test_closed_fence():
+    assert strip_json_fence('Sure:\n```json\n{"done": true}\n```\nanything else') == '{"done": true}'
+
+
+def test_unclosed_fence():
+    assert strip_json_fence('```json\n{"done": true, "summary": "ok"}') == '{"done": true, "summary": "ok"}'
+
+
+def test_no_fence():
+    assert strip_json_fence('  {"1": "query"}\n') == '{"1": "query"}'
@@ -0,0 +1,34 @@
+"""
+uv run pytest tests/test_tools/test_table_eda.py
+"""
+import pandas as pd
+import pytest
+
+from generalist.tools.code import _frame_stats, _parquet_stats
+
+
+@pytest.fixture
+def frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        "a": [1.0, None, 3.0, 4.0, 10.0],
+        "b": ["x", "y", "z", "w", "v"],
+        "c": [5, 4, 3, 2, 1],
+    })
+
+
+@pytest.mark.parametrize("index", [None, "b"])
+def test_streamed_parquet_stats_match_in_memory_stats(tmp_path, frame, index):
+    path = tmp_path / "table.parquet"
+    (frame.set_index(index) if index else frame).to_parquet(path)
+
+    n_rows, columns, dtypes, col_stats = _parquet_stats(str(path), batch_size=2)
+    expected_rows, expected_columns, expected_dtypes, expected_stats = _frame_stats(pd.read_parquet(path))
+
+    assert n_rows == expected_rows
+    assert columns == expected_columns
+    assert dtypes.equals(expected_dtypes)
+    for col in columns:
+        stats, expected = col_stats[col], expected_stats[col]
+        assert (stats["nans"], stats["count"], stats["min"], stats["max"]) == \
+               (expected["nans"], expected["count"], expected["min"], expected["max"])
+        assert stats["mean"] == pytest.approx(expected["mean"])